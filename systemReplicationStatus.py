@@ -1,8 +1,4 @@
-import os, types, sys, traceback, getopt, datetime
-import NameServerPy
-import ConfigMgrPy
-
-NameServerPy.init()
+import os, types, sys, array, collections, traceback, getopt, datetime, time, stat, threading, signal, Queue
 
 class ServiceStatus:
     NoHSR        = 10
@@ -12,6 +8,7 @@ class ServiceStatus:
     Syncing      = 14
     Active       = 15
     __strmap={NoHSR:'System Replication not active', Error:'ERROR', Unknown:'UNKNOWN', Initializing:'INITIALIZING', Syncing:'SYNCING', Active:'ACTIVE'}
+    __valmap=dict((v, n) for n, v in __strmap.items())
 
     ActiveYes = "YES"
     ActiveNo = "NO"
@@ -22,21 +19,680 @@ class ServiceStatus:
 
     @staticmethod
     def fromStr(s, activeStatus, default = Error): 
-        for n, v in ServiceStatus.__strmap.iteritems():
-            if s == v:
-                return n
-
+        try:
+            return ServiceStatus.__valmap.get(s, default)
+        except TypeError: # unhashable, cannot be one of the status strings
+            return default
+
+def formatTimestamp(v):
+    if v > 0:
+        return datetime.datetime.fromtimestamp(int(v)/1000.0/1000.0).strftime('%Y-%m-%d %H:%M:%S.%f')
+    return "-"
+
+# Compact column store for the rows returned by ns.getSystemReplicationStatus.
+# Values are kept raw, integer columns are packed into arrays and *_TIME columns are only formatted when a
+# row view reads them, so the microsecond timestamps stay available through StatusRow.raw().
+class StatusTable(object):
+    __slots__ = ("columns", "index", "isTime", "data", "formatTimes", "formatted", "fixed")
+    missing = object()
+
+    # fixed: keep only the given columns, other values of appended rows are dropped
+    def __init__(self, columns, fixed = False):
+        self.fixed = fixed
+        self.columns = []
+        self.index = {}
+        self.isTime = []
+        self.data = []
+        self.formatTimes = array.array('b')
+        self.formatted = {}
+        for c in columns:
+            self.addColumn(c)
+
+    def __len__(self):
+        return len(self.formatTimes)
+
+    def addColumn(self, column):
+        self.index[column] = len(self.columns)
+        self.columns.append(column)
+        self.isTime.append(column.endswith("_TIME"))
+        self.data.append([StatusTable.missing] * len(self))
+
+    def append(self, row):
+        if not self.fixed and not self.index.viewkeys() >= row.viewkeys():
+            for k in row:
+                if k not in self.index:
+                    self.addColumn(k)
+        get = row.get
+        missing = StatusTable.missing
+        for c, values in zip(self.columns, self.data):
+            values.append(get(c, missing))
+        self.formatTimes.append(0)
+
+    # store columns holding plain ints only as machine words
+    def compact(self):
+        if array.array('l').itemsize < 8:
+            return
+        for i, values in enumerate(self.data):
+            if isinstance(values, list) and values and all(type(v) is int for v in values):
+                self.data[i] = array.array('l', values)
+
+    def row(self, i):
+        return StatusRow(self, i)
+
+    def rows(self):
+        return [StatusRow(self, i) for i in xrange(len(self))]
+
+    def raw(self, i, column):
+        v = self.data[self.index[column]][i]
+        if v is StatusTable.missing:
+            raise KeyError(column)
+        return v
+
+    def value(self, i, c):
+        v = self.data[c][i]
+        if self.isTime[c] and self.formatTimes[i] and type(v) in (int, long):
+            f = self.formatted.get(v)
+            if f is None:
+                f = self.formatted[v] = formatTimestamp(v) if profiler is None else profiler.timed("format", formatTimestamp, v)
+            return f
+        return v
+
+    def set(self, i, column, v):
+        if column not in self.index:
+            self.addColumn(column)
+        c = self.index[column]
+        if not isinstance(self.data[c], list):
+            self.data[c] = list(self.data[c])
+        self.data[c][i] = v
+
+# unformatted value of a status row, None if the row does not carry a number for it
+def rawValue(row, key):
+    if isinstance(row, StatusRow):
+        v = row.raw(key) if key in row else None
+    else:
+        v = row.get(key)
+    if type(v) in (int, long, float):
+        return v
+    return None
+
+# command line arguments and str values from the nameserver are UTF-8
+def toUnicode(value):
+    if isinstance(value, str):
+        return value.decode("utf-8", "replace")
+    return unicode(value)
+
+def encodeUtf8(value):
+    if isinstance(value, unicode):
+        return value.encode("utf-8")
+    return value
+
+# items of a status row with unformatted values
+def rawItems(row):
+    if isinstance(row, StatusRow):
+        return row.rawItems()
+    return row.items()
+
+# rows as plain dicts with the values the row views show
+def toDicts(rows):
+    return [row.toDict() if isinstance(row, StatusRow) else row for row in rows]
+
+# dict compatible view on one row of a StatusTable
+class StatusRow(object):
+    __slots__ = ("table", "i")
+
+    def __init__(self, table, i):
+        self.table = table
+        self.i = i
+
+    def __getitem__(self, key):
+        c = self.table.index[key]
+        v = self.table.value(self.i, c)
+        if v is StatusTable.missing:
+            raise KeyError(key)
+        return v
+
+    def __setitem__(self, key, value):
+        self.table.set(self.i, key, value)
+
+    def __contains__(self, key):
+        c = self.table.index.get(key)
+        return c is not None and self.table.data[c][self.i] is not StatusTable.missing
+
+    has_key = __contains__
+
+    def get(self, key, default = None):
+        if key in self:
+            return self[key]
         return default
 
+    def raw(self, key):
+        return self.table.raw(self.i, key)
+
+    def keys(self):
+        return [c for c in self.table.columns if c in self]
+
+    def iterkeys(self):
+        return iter(self.keys())
+
+    __iter__ = iterkeys
+
+    def __len__(self):
+        return len(self.keys())
+
+    def values(self):
+        return [self[c] for c in self.keys()]
+
+    def items(self):
+        return [(c, self[c]) for c in self.keys()]
+
+    def iteritems(self):
+        return iter(self.items())
+
+    def toDict(self):
+        return dict(self.items())
+
+    def rawItems(self):
+        return [(c, self.table.data[self.table.index[c]][self.i]) for c in self.keys()]
+
+    def __eq__(self, other):
+        if isinstance(other, StatusRow):
+            other = other.toDict()
+        return self.toDict() == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return repr(self.toDict())
+
+# The rows of one ns.getSystemReplicationStatus call. Standby services (VOLUME_ID 0) and rows not matching the filters
+# are dropped before anything is stored: siteName (the secondary site, excludes unmapped secondaries), host, database
+# and service, all case insensitive. Only the given columns are stored if any. The rows are grouped
+# by SITE_ID in ascending order (the order of the former stable sort) and a single pass then stores them, indexes them
+# by secondary site id and name, host, port, service and database and aggregates the replication status per secondary
+# site and per database and secondary site. Rows with an unmapped secondary are indexed and aggregated under notMapped,
+# STOPPED and TENANTCOPY services are listed but not aggregated.
+class LandscapeModel(object):
+    indexColumns = ["SECONDARY_SITE_ID", "SECONDARY_SITE_NAME", "HOST", "PORT", "SERVICE_NAME", "DATABASE"]
+    notMapped = "NOT MAPPED"
+
+    def __init__(self, rows, siteName = None, host = None, database = None, service = None, columns = None):
+        wanted = LandscapeModel.wanted(host, database, service)
+        bySiteId = {}
+        for row in rows:
+            if not LandscapeModel.isSelected(row, siteName, wanted):
+                continue
+            bucket = bySiteId.get(row['SITE_ID'])
+            if bucket is None:
+                bucket = bySiteId[row['SITE_ID']] = []
+            bucket.append(row)
+
+        if columns is not None:
+            self.table = StatusTable(columns, True)
+        else:
+            self.table = StatusTable(rows[0].keys() if rows else [])
+        self.indexes = dict((c, {}) for c in LandscapeModel.indexColumns) # column -> value (site names in lower case) -> row numbers
+        self.siteStatus = collections.OrderedDict() # secondary site id -> status record, in order of the first row
+        self.siteNameStatus = collections.OrderedDict() # secondary site name -> ServiceStatus
+        self.databaseStatus = {} # (database, secondary site id) -> ServiceStatus
+        self.siteIds = {} # secondary site name in lower case -> secondary site id
+
+        ordered = []
+        for siteId in sorted(bySiteId):
+            ordered.extend(bySiteId[siteId])
+
+        for i, row in enumerate(ordered):
+            self.table.append(row)
+            mapped = row["SECONDARY_HOST"].lower() not in ["not mapped", "not_mapped"]
+            if mapped:
+                self.addToIndex("SECONDARY_SITE_ID", row["SECONDARY_SITE_ID"], i)
+                self.addToIndex("SECONDARY_SITE_NAME", row["SECONDARY_SITE_NAME"].lower(), i)
+            else:
+                self.addToIndex("SECONDARY_SITE_ID", LandscapeModel.notMapped, i)
+            for c in ("HOST", "PORT", "SERVICE_NAME", "DATABASE"):
+                if c in row:
+                    self.addToIndex(c, row[c], i)
+
+            if row['REPLICATION_STATUS'] == "STOPPED" or row['REPLICATION_STATUS'] == "TENANTCOPY":
+                continue
+            if not mapped:
+                self.siteStatus[LandscapeModel.notMapped] = {"SECONDARY_SITE_NAME" : "ERROR",
+                     "REPLICATION_MODE" : "ERROR",
+                     "REPLICATION_STATUS" : ServiceStatus.Error}
+                self.siteNameStatus[LandscapeModel.notMapped] = ServiceStatus.Error
+                self.databaseStatus[(row.get("DATABASE"), LandscapeModel.notMapped)] = ServiceStatus.Error
+                continue
+
+            secondaryId = row["SECONDARY_SITE_ID"]
+            secondaryName = row["SECONDARY_SITE_NAME"]
+            st = self.siteStatus.get(secondaryId)
+            if st is None:
+                st = self.siteStatus[secondaryId] = {"SECONDARY_SITE_NAME" : secondaryName,
+                     "REPLICATION_MODE" : row["REPLICATION_MODE"],
+                     "SOURCE_SITE_ID" : row["SITE_ID"],
+                     "REPLICATION_STATUS" : ServiceStatus.Active}
+                self.siteIds.setdefault(secondaryName.lower(), secondaryId)
+            service_status = ServiceStatus.fromStr(row['REPLICATION_STATUS'], row.get('SECONDARY_ACTIVE_STATUS')) # only requested when shown
+            if service_status < st["REPLICATION_STATUS"]:
+                st["REPLICATION_STATUS"] = service_status
+            self.siteNameStatus[secondaryName] = min(service_status, self.siteNameStatus.get(secondaryName, ServiceStatus.Active))
+            key = (row.get("DATABASE"), secondaryId)
+            self.databaseStatus[key] = min(service_status, self.databaseStatus.get(key, ServiceStatus.Active))
+
+            self.table.formatTimes[i] = 1 # *_TIME values of aggregated rows are shown formatted
+        self.table.compact()
+
+    @staticmethod
+    def wanted(host, database, service):
+        return [(c, toUnicode(v).lower()) for c, v in [("HOST", host), ("DATABASE", database), ("SERVICE_NAME", service)] if v is not None]
+
+    @staticmethod
+    def isSelected(row, siteName, wanted):
+        if row['VOLUME_ID'] == 0: # do not show standy services as they do not replicate anything
+            return False
+        if siteName is not None:
+            if row["SECONDARY_HOST"].lower() in ["not mapped", "not_mapped"] or row["SECONDARY_SITE_NAME"].lower() != siteName.lower():
+                return False
+        if wanted and [c for c, v in wanted if toUnicode(row.get(c, "")).lower() != v]:
+            return False
+        return True
+
+    # The overall status determineOverallStatus computes from getSiteStatus() of a model of the same rows, without
+    # building the model. Stops at the first service in ERROR or with an unmapped secondary, nothing is worse than that.
+    # None if no row is aggregated (an empty site status).
+    @staticmethod
+    def overallStatus(rows, siteName = None, host = None, database = None, service = None):
+        wanted = LandscapeModel.wanted(host, database, service)
+        overall = None
+        for row in rows:
+            if not LandscapeModel.isSelected(row, siteName, wanted):
+                continue
+            if row['REPLICATION_STATUS'] == "STOPPED" or row['REPLICATION_STATUS'] == "TENANTCOPY":
+                continue
+            if row["SECONDARY_HOST"].lower() in ["not mapped", "not_mapped"]:
+                return ServiceStatus.Error
+            service_status = ServiceStatus.fromStr(row['REPLICATION_STATUS'], row.get('SECONDARY_ACTIVE_STATUS'))
+            if overall is None:
+                overall = ServiceStatus.Active
+            if service_status < overall:
+                overall = service_status
+                if overall == ServiceStatus.Error:
+                    return overall
+        return overall
+
+    def addToIndex(self, column, value, i):
+        rows = self.indexes[column].get(value)
+        if rows is None:
+            rows = self.indexes[column][value] = array.array('l')
+        rows.append(i)
+
+    def __len__(self):
+        return len(self.table)
+
+    # row views in SITE_ID order, restricted to the rows matching all given values, a site name is matched case
+    # insensitive and excludes unmapped secondaries
+    def getRows(self, siteId = None, siteName = None, host = None, port = None, service = None, database = None):
+        selected = []
+        for column, value in [("SECONDARY_SITE_ID", siteId), ("SECONDARY_SITE_NAME", siteName and siteName.lower()), ("HOST", host), ("PORT", port), ("SERVICE_NAME", service), ("DATABASE", database)]:
+            if value is not None:
+                selected.append(self.indexes[column].get(value, ()))
+        if not selected:
+            return self.table.rows()
+        selected.sort(key = len)
+        others = [set(rows) for rows in selected[1:]]
+        return [StatusRow(self.table, i) for i in selected[0] if all(i in rows for rows in others)]
+
+    # {secondary site id: {"SECONDARY_SITE_NAME", "REPLICATION_MODE", "SOURCE_SITE_ID", "REPLICATION_STATUS"}}
+    # as returned by getLandscapeConfigurationUpdatedVersion
+    def getSiteStatus(self, siteName = None):
+        status = {}
+        for id, st in self.siteStatus.items():
+            if siteName is None or (id != LandscapeModel.notMapped and st["SECONDARY_SITE_NAME"].lower() == siteName.lower()):
+                status[id] = dict(st)
+        return status
+
+    # {secondary site name: ServiceStatus} as returned by getLandscapeConfiguration
+    def getSiteNameStatus(self, siteName = None):
+        status = {}
+        for name, st in self.siteNameStatus.items():
+            if siteName is None or (name != LandscapeModel.notMapped and name.lower() == siteName.lower()):
+                status[name] = st
+        return status
+
+    # aggregated ServiceStatus of the services of database replicating to the secondary site (id or name),
+    # None if the database has no such services
+    def getStatus(self, database, site):
+        if isinstance(site, basestring) and site != LandscapeModel.notMapped:
+            site = self.siteIds.get(site.lower())
+        return self.databaseStatus.get((database, site))
+
+# Access to the nameserver and to the configuration layers of the local HANA system. Everything this script reads
+# goes through the current backend, a replacement (e.g. the synthetic landscapes of systemReplicationStatusFakeBackend.py)
+# is installed with setBackend. Its clients must provide disableNSLibraryLoad, setNoRetries, useMasterNameServer,
+# storeTrees, getDRMode, getDRDatacenter, drGetSourceSystem, getServiceHost, getSystemReplicationInfo,
+# getSystemReplicationStatus and getTree, its configurations getStringValue.
+# NameServerPy and ConfigMgrPy are only imported and initialized when the first backend is requested, importing this
+# module, --help and invalid arguments do not touch the HANA installation.
+class HanaBackend(object):
+    layers = ("CUSTOMER", "READONLY")
+
+    def __init__(self):
+        import NameServerPy, ConfigMgrPy
+        NameServerPy.init()
+        self.nameServer = NameServerPy
+        self.configMgr = ConfigMgrPy
+
+    def createTNSClient(self):
+        return self.nameServer.TNSClient()
+
+    def createTreeNode(self):
+        return self.nameServer.TNode()
+
+    # layer is one of the names in layers
+    def getConfiguration(self, fileName, layer):
+        return self.configMgr.LayeredConfiguration(fileName, getattr(self.configMgr, layer))
+
+    # The directories of the files a layer merges, None for those not known in this environment.
+    # CUSTOMER: system (instance) and host layer, READONLY: the default layer of the installed executables below them.
+    @staticmethod
+    def getConfigurationDirectories(layer):
+        globalDir = os.environ.get("DIR_GLOBAL")
+        if not globalDir and os.environ.get("DIR_INSTANCE"):
+            globalDir = os.path.join(os.environ["DIR_INSTANCE"], "..", "SYS", "global")
+        directories = [globalDir and os.path.join(globalDir, "hdb", "custom", "config"), os.environ.get("SAP_RETRIEVAL_PATH")]
+        if layer == "READONLY":
+            directories.insert(0, os.environ.get("DIR_EXECUTABLE") and os.path.join(os.environ["DIR_EXECUTABLE"], "config"))
+        return directories
+
+    # Changes whenever a file behind the layer is modified, None if the files are unknown (not in a HANA environment).
+    def getConfigurationStamp(self, fileName, layer):
+        directories = HanaBackend.getConfigurationDirectories(layer)
+        if not [d for d in directories if d]:
+            return None
+        stamp = []
+        for d in directories:
+            try:
+                st = os.stat(os.path.join(d, fileName))
+                stamp.append((st.st_mtime, st.st_size, st.st_ino))
+            except (OSError, TypeError, AttributeError):
+                stamp.append(None)
+        return tuple(stamp)
+
+backend = None
+backendLock = threading.Lock() # the daemon and exporter threads may request the first backend concurrently
+
+def getBackend():
+    global backend
+    with backendLock:
+        if backend is None:
+            backend = HanaBackend()
+    return backend
+
+def setBackend(newBackend):
+    global backend
+    backend = newBackend
+
+# Per-phase profiling for --profile. Phases are timed exclusively: the time of a phase nested into another one (a
+# timestamp formatted or a configuration value read while rendering) only counts for the inner phase, so the phases add
+# up to the wall time they cover. Counts (nameserver calls, configuration layers opened, rows, columns) are summed per
+# name. Subclasses hook into phaseEnded and counted, install a profiler with setProfiler.
+class Profiler(object):
+    def __init__(self):
+        self.start = time.time()
+        self.phases = collections.OrderedDict() # name -> [calls, seconds]
+        self.counts = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.local = threading.local() # the open phases of each thread
+
+    def stack(self):
+        stack = getattr(self.local, "stack", None)
+        if stack is None:
+            stack = self.local.stack = []
+        return stack
+
+    def phase(self, name):
+        return ProfilePhase(self, name)
+
+    def timed(self, name, function, *args):
+        with self.phase(name):
+            return function(*args)
+
+    def phaseEnded(self, name, seconds):
+        with self.lock:
+            entry = self.phases.get(name)
+            if entry is None:
+                entry = self.phases[name] = [0, 0.0]
+            entry[0] += 1
+            entry[1] += seconds
+
+    def counted(self, name, n):
+        with self.lock:
+            self.counts[name] = self.counts.get(name, 0) + n
+
+    def summary(self):
+        with self.lock:
+            summary = collections.OrderedDict()
+            summary["wallSeconds"] = round(time.time() - self.start, 6)
+            summary["phases"] = collections.OrderedDict((name, {"calls": calls, "seconds": round(seconds, 6)}) for name, (calls, seconds) in self.phases.items())
+            summary.update(self.counts)
+        return summary
+
+    # one json object on stderr, stdout is left to the status output
+    def report(self, stream = None):
+        import json # only needed by --profile
+        stream = stream or sys.stderr
+        stream.write(json.dumps(self.summary()) + "\n")
+        stream.flush()
+
+class ProfilePhase(object):
+    __slots__ = ("profiler", "name", "start", "nested")
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.profiler.stack().append(self)
+        self.nested = 0.0
+        self.start = time.time()
+
+    def __exit__(self, *excInfo):
+        elapsed = time.time() - self.start
+        stack = self.profiler.stack()
+        stack.pop()
+        if stack:
+            stack[-1].nested += elapsed
+        self.profiler.phaseEnded(self.name, elapsed - self.nested)
+        return False
+
+class NoProfilePhase(object):
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *excInfo):
+        return False
+
+profiler = None
+noProfilePhase = NoProfilePhase()
+
+def setProfiler(newProfiler):
+    global profiler
+    profiler = newProfiler
+
+def profilePhase(name):
+    if profiler is None:
+        return noProfilePhase
+    return profiler.phase(name)
+
+def profileCount(name, n = 1):
+    if profiler is not None:
+        profiler.counted(name, n)
+
+# The global.ini values needed by a run. Each configuration layer is opened once and the values read from it are kept
+# until refresh() finds the files behind the layer changed, so polling modes (--watch, --daemon, --exporter) only
+# re-read after a change. loads and loadTime count the layers opened and the seconds spent opening and reading them.
+class ConfigurationSnapshot(object):
+    def __init__(self, fileName = "global.ini"):
+        self.fileName = fileName
+        self.layers = {} # layer -> (stamp, configuration, {(section, key): value})
+        self.loads = 0
+        self.loadTime = 0.0
+
+    def refresh(self):
+        for layer, (stamp, configuration, values) in self.layers.items():
+            if stamp is None or getBackend().getConfigurationStamp(self.fileName, layer) != stamp:
+                del self.layers[layer]
+
+    def getStringValue(self, layer, section, key):
+        entry = self.layers.get(layer)
+        if entry is not None and (section, key) in entry[2]:
+            return entry[2][(section, key)]
+
+        start = time.time()
+        with profilePhase("config"):
+            if entry is None:
+                stamp = getBackend().getConfigurationStamp(self.fileName, layer) # taken first, a change while opening is seen by the next refresh
+                entry = self.layers[layer] = (stamp, getBackend().getConfiguration(self.fileName, layer), {})
+                self.loads += 1
+                profileCount("configLayersOpened")
+            value = entry[2][(section, key)] = entry[1].getStringValue(section, key)
+        self.loadTime += time.time() - start
+        return value
+
+# One nameserver session per run: the client is created once, the nameserver is probed once and
+# the DR mode, replication info and datacenter ids are cached for all checks of the run.
+class SystemReplicationStatusSession(object):
+    probeGrace = 0.5 # seconds the local nameserver has to answer before the master nameserver is probed as well
+
+    def __init__(self, ns = None):
+        self.ns = ns
+        self.localClient = None
+        self.masterClient = None
+        self.probing = set() # clients whose probe has not returned yet
+        self.nsCalls = 0 # number of nameserver round-trips made through this session
+        self.configuration = ConfigurationSnapshot()
+        self.reset()
+
+    # drop the cached probe results, the client itself is kept and the configuration only re-read where it changed
+    def reset(self):
+        self.configuration.refresh()
+        self.__nsActive = None
+        self.__drMode = None
+        self.__replicationInfo = None
+        self.__datacenter = None
+        self.__sourceSystem = None
+        self.__serviceHost = None
+
+    def getClient(self):
+        if self.ns is None:
+            self.ns = SystemReplicationStatusUtils.createTNSClient()
+        return self.ns
+
+    def call(self, method, *args):
+        self.nsCalls += 1
+        profileCount("nsCalls")
+        with profilePhase("fetch" if method in ("getSystemReplicationStatus", "getTree") else "probe"):
+            return getattr(self.getClient(), method)(*args)
+
+    # The local nameserver is probed first. Only when it fails or has not answered within probeGrace the master nameserver
+    # (in case this script is executed on a stopped slave host) is probed as well and the client of the first to answer
+    # is used. The local and the master client are created once per session. A hung probe cannot be interrupted, it is
+    # left to its daemon thread and its client is not probed again until it returned.
+    def isNsActive(self):
+        if self.__nsActive is None:
+            with profilePhase("probe"):
+                if self.localClient is None:
+                    self.localClient = self.getClient()
+                answers = Queue.Queue()
+                pending = 0
+                nsActive = False
+                if self.startProbe(self.localClient, False, answers):
+                    pending += 1
+                    try:
+                        ns, answered = answers.get(True, SystemReplicationStatusSession.probeGrace)
+                        pending -= 1
+                        nsActive = answered
+                    except Queue.Empty:
+                        pass
+
+                if nsActive:
+                    self.ns = self.localClient
+                else:
+                    if self.masterClient is None:
+                        self.masterClient = SystemReplicationStatusUtils.createTNSClient()
+                    if self.startProbe(self.masterClient, True, answers):
+                        pending += 1
+                    while pending and not nsActive:
+                        ns, nsActive = answers.get()
+                        pending -= 1
+                        if nsActive:
+                            self.ns = ns
+
+            self.__nsActive = nsActive
+        return self.__nsActive
+
+    # returns False if the previous probe of ns still hangs
+    def startProbe(self, ns, master, answers):
+        if ns in self.probing:
+            return False
+        self.probing.add(ns)
+        thread = threading.Thread(target = self.probe, args = (ns, master, answers))
+        thread.daemon = True
+        thread.start()
+        return True
+
+    # puts (ns, True) into answers if its nameserver answered, else (ns, False)
+    def probe(self, ns, master, answers):
+        try:
+            ns.setNoRetries()
+            if master:
+                ns.useMasterNameServer(True)
+            self.nsCalls += 1
+            profileCount("nsCalls")
+            ns.storeTrees([]) # force call to nameserver, else ns.getLandscapeConfiguration() could guess config from obsolete shared memory
+            answered = True
+        except:
+            answered = False
+        self.probing.discard(ns)
+        answers.put((ns, answered))
+
+    def getDRMode(self):
+        if self.__drMode is None:
+            self.__drMode = self.call("getDRMode").upper()
+        return self.__drMode
+
+    def getSystemReplicationInfo(self):
+        if self.__replicationInfo is None:
+            self.__replicationInfo = self.call("getSystemReplicationInfo")
+        return self.__replicationInfo
+
+    def getDRDatacenter(self):
+        if self.__datacenter is None:
+            self.__datacenter = self.call("getDRDatacenter")
+        return self.__datacenter
+
+    def drGetSourceSystem(self):
+        if self.__sourceSystem is None:
+            self.__sourceSystem = self.call("drGetSourceSystem")
+        return self.__sourceSystem
+
+    def getServiceHost(self):
+        if self.__serviceHost is None:
+            self.__serviceHost = self.call("getServiceHost")
+        return self.__serviceHost
+
+    def getSystemReplicationStatus(self, requestSecondaryActiveStatus, host):
+        return self.call("getSystemReplicationStatus", requestSecondaryActiveStatus, host)
+
 class SystemReplicationStatusUtils(object):
     @staticmethod
     def createTNSClient():
-        ns = NameServerPy.TNSClient()
+        ns = getBackend().createTNSClient()
         ns.disableNSLibraryLoad()
         return ns
 
     @staticmethod
-    def determineAndPrintOverallStatus(status, sapcontrol):
+    def determineAndPrintOverallStatus(status, sapcontrol, session = None):
         if not sapcontrol:
             print
 
@@ -52,8 +708,7 @@ class SystemReplicationStatusUtils(object):
 
         if len(status) == 0:
             # --localhost on a primary standby host
-            ns = SystemReplicationStatusUtils.createTNSClient()
-            mode = ns.getDRMode().upper()
+            mode = (session or SystemReplicationStatusSession()).getDRMode()
             if mode == "PRIMARY":
                 if sapcontrol:
                     print 'overall_replication_status=%s' % ServiceStatus.toStr(ServiceStatus.Active)
@@ -84,20 +739,51 @@ class SystemReplicationStatusUtils(object):
             print 'overall system replication status:', ServiceStatus.toStr(overall)
         return overall
 
+    # same result as determineAndPrintOverallStatus, without printing anything
+    @staticmethod
+    def determineOverallStatus(status, session = None):
+        if isinstance(status, int):
+            return status
+
+        if len(status) == 0:
+            mode = (session or SystemReplicationStatusSession()).getDRMode()
+            if mode == "PRIMARY":
+                return ServiceStatus.Active
+            return ServiceStatus.NoHSR
+
+        overall = ServiceStatus.Active
+        for st in status.values():
+            if st["REPLICATION_STATUS"] < overall:
+                overall = st["REPLICATION_STATUS"]
+        return overall
+
     @staticmethod
-    def printLocalHSRInformation(sapcontrol):
-        ns = SystemReplicationStatusUtils.createTNSClient()
-        mode = ns.getDRMode().upper()
-        siteId = ns.getDRDatacenter()
-        sourceSiteId = ns.drGetSourceSystem()
-        primaryMasters = ConfigMgrPy.LayeredConfiguration('global.ini', ConfigMgrPy.CUSTOMER).getStringValue("system_replication_site_masters", str(sourceSiteId))
-        primaryMasterWithoutPort = " ".join(x.split(":")[0] for x in primaryMasters.split(" "))
+    def getLocalHSRInformation(session = None):
+        session = session or SystemReplicationStatusSession()
+        mode = session.getDRMode()
+        siteId = session.getDRDatacenter()
+        sourceSiteId = session.drGetSourceSystem()
+        info = collections.OrderedDict()
+        info["REPLICATION_MODE"] = mode
+        info["SITE_ID"] = siteId
+        info["SITE_NAME"] = session.configuration.getStringValue("CUSTOMER", "system_replication", "site_name")
+        if not mode == "PRIMARY":
+            primaryMasters = session.configuration.getStringValue("CUSTOMER", "system_replication_site_masters", str(sourceSiteId))
+            info["SOURCE_SITE_ID"] = sourceSiteId
+            info["PRIMARY_MASTERS"] = " ".join(x.split(":")[0] for x in primaryMasters.split(" "))
+        return info
+
+    @staticmethod
+    def printLocalHSRInformation(sapcontrol, session = None):
+        info = SystemReplicationStatusUtils.getLocalHSRInformation(session)
+        mode = info["REPLICATION_MODE"]
+        siteId = info["SITE_ID"]
         if sapcontrol:
             print "site/%d/REPLICATION_MODE=%s" % (siteId, mode)
-            print "site/%d/SITE_NAME=%s" % (siteId, ConfigMgrPy.LayeredConfiguration('global.ini', ConfigMgrPy.CUSTOMER).getStringValue("system_replication", "site_name"))
+            print "site/%d/SITE_NAME=%s" % (siteId, info["SITE_NAME"])
             if not mode == "PRIMARY":
-                print "site/%d/SOURCE_SITE_ID=%s" % (siteId, sourceSiteId)
-                print "site/%d/PRIMARY_MASTERS=%s" % (siteId, primaryMasterWithoutPort)
+                print "site/%d/SOURCE_SITE_ID=%s" % (siteId, info["SOURCE_SITE_ID"])
+                print "site/%d/PRIMARY_MASTERS=%s" % (siteId, info["PRIMARY_MASTERS"])
             print "local_site_id=%d" % siteId
         else:
             print
@@ -106,58 +792,400 @@ class SystemReplicationStatusUtils(object):
             print
             print "mode: %s" % mode
             print "site id: %s" % siteId
-            print "site name: %s" % ConfigMgrPy.LayeredConfiguration('global.ini', ConfigMgrPy.CUSTOMER).getStringValue("system_replication", "site_name")
+            print "site name: %s" % info["SITE_NAME"]
             if not mode == "PRIMARY":
-                print "active primary site: %s" % sourceSiteId
-                print "primary masters: %s" % primaryMasterWithoutPort
-
-class SystemReplicationStatus(object):
-    def getStatusAndPrint(self, longFormat, site, sapcontrol, requestSecondaryActiveStatus = True, local = False):
-        # No HSR
-
-        mode = self.getDRMode()
-        if not mode:
-            if sapcontrol:
-                print "SAPCONTROL-OK: <begin>"
-                print "local_site_id=0"
+                print "active primary site: %s" % info["SOURCE_SITE_ID"]
+                print "primary masters: %s" % info["PRIMARY_MASTERS"]
+
+# Machine readable output for --format=json|ndjson|csv. Records are written as they are passed in, numbers
+# (log positions, sizes, durations, microsecond timestamps) stay numbers.
+# json: one object {"services": [...], "sites": [...], "overall": {...}, "local": {...}}
+# ndjson: one object per line, the record type is in the RECORD field
+# csv: one section per record type with its own header line, sections are separated by an empty line
+class StructuredStatusWriter(object):
+    formats = ["json", "ndjson", "csv"]
+
+    def __init__(self, format, stream = None):
+        self.format = format
+        self.stream = stream or sys.stdout
+        self.sections = 0
+        if format == "json":
+            self.stream.write("{")
+        elif format == "csv":
+            import csv # only needed by --format=csv
+            self.csv = csv.writer(self.stream, lineterminator = "\n")
+
+    def writeRecords(self, name, recordType, records, single = False):
+        import json # only needed by --format
+        if self.format == "json":
+            if self.sections:
+                self.stream.write(", ")
+            self.stream.write(json.dumps(name) + ": ")
+            if single:
+                for record in records:
+                    self.stream.write(json.dumps(record))
             else:
-                print "this system is not a system replication site"
+                self.stream.write("[")
+                for i, record in enumerate(records):
+                    if i:
+                        self.stream.write(", ")
+                    self.stream.write(json.dumps(record))
+                self.stream.write("]")
+        elif self.format == "ndjson":
+            for record in records:
+                line = collections.OrderedDict([("RECORD", recordType)])
+                line.update(record)
+                self.stream.write(json.dumps(line) + "\n")
+        else:
+            columns = None
+            for record in records:
+                if columns is None:
+                    if self.sections:
+                        self.stream.write("\n")
+                    columns = record.keys()
+                    self.csv.writerow(columns)
+                self.csv.writerow([encodeUtf8(record.get(c)) for c in columns]) # the csv module only writes byte strings
+        self.sections += 1
+
+    # the fields in the order of columns (as getColumns returns them), columns of the row not in there follow
+    def writeServices(self, config, columns = []):
+        def record(row):
+            items = collections.OrderedDict(rawItems(row))
+            ordered = collections.OrderedDict((c, items.pop(c)) for c in columns if c in items)
+            ordered.update(items)
+            return ordered
+        self.writeRecords("services", "service", (record(row) for row in config))
+
+    def writeSites(self, status, siteMetrics = {}):
+        records = []
+        if not isinstance(status, int):
+            for id, st in status.items():
+                record = collections.OrderedDict()
+                record["SITE_ID"] = id
+                record["SITE_NAME"] = st["SECONDARY_SITE_NAME"]
+                record["SOURCE_SITE_ID"] = st.get("SOURCE_SITE_ID")
+                record["REPLICATION_MODE"] = st["REPLICATION_MODE"]
+                record["REPLICATION_STATUS"] = ServiceStatus.toStr(st["REPLICATION_STATUS"])
+                record["STATUS_CODE"] = st["REPLICATION_STATUS"]
+                for k, v in siteMetrics.get(id, {}).items():
+                    if k != "SITE_NAME":
+                        record[k] = v
+                records.append(record)
+        self.writeRecords("sites", "site", records)
+
+    def writeOverall(self, overall, message = None):
+        record = collections.OrderedDict()
+        record["REPLICATION_STATUS"] = ServiceStatus.toStr(overall)
+        record["STATUS_CODE"] = overall
+        if message:
+            record["MESSAGE"] = message
+        self.writeRecords("overall", "overall", [record], True)
+
+    def writeLocal(self, info):
+        self.writeRecords("local", "local", [info], True)
+
+    # the sites of buildLandscapeTree in printed order, each with its parent and the status of the replication from it
+    def writeTree(self, tree, skipped = []):
+        records = []
+        parents = {}
+        for node, depth in walkTree(tree):
+            for child in node.children:
+                parents[child.id] = node.id
+            record = collections.OrderedDict()
+            record["SITE_ID"] = node.id
+            record["SITE_NAME"] = node.name
+            record["MODE"] = node.mode
+            record["PARENT_SITE_ID"] = parents.get(node.id)
+            record["DEPTH"] = depth
+            record["REPLICATION_MODE"] = node.replicationMode
+            record["REPLICATION_STATUS"] = ServiceStatus.toStr(node.replicationStatus) if node.replicationStatus is not None else None
+            record["STATUS_CODE"] = node.replicationStatus
+            records.append(record)
+        self.writeRecords("tree", "tree_site", records)
+        self.writeRecords("skipped_mappings", "skipped_mapping", (collections.OrderedDict([("SOURCE_SITE_ID", source), ("TARGET_SITE_ID", target), ("REASON", reason)]) for source, target, reason in skipped))
+
+    def close(self):
+        if self.format == "json":
+            self.stream.write("}\n")
+        self.stream.flush()
+
+# Replication lag and throughput derived from the rows of getLandscapeConfigurationUpdatedVersion.
+# Durations and *_TIME values are microseconds, rates are per second. Keep one instance across polls (--watch) to get
+# the SAMPLED_* rates from the deltas between successive samples.
+class ReplicationMetrics(object):
+    serviceColumns = ["LOG_POSITION_LAG", "LOG_TIME_LAG", "SHIPPING_THROUGHPUT", "FULL_REPLICA_RATE", "DELTA_REPLICA_RATE", "SAMPLED_LOG_POSITION_RATE", "SAMPLED_SHIPPING_THROUGHPUT"]
+    serviceHeaders = ["Log Position\nLag", "Log Time\nLag (s)", "Shipping\nThroughput (B/s)", "Full Replica\nRate (B/s)", "Delta Replica\nRate (B/s)", "Sampled Log\nPositions/s", "Sampled Shipping\nThroughput (B/s)"]
+    siteColumns = ["SITE_ID", "SITE_NAME", "SERVICES", "LOG_POSITION_LAG", "LOG_TIME_LAG", "SHIPPING_THROUGHPUT", "FULL_REPLICA_RATE", "DELTA_REPLICA_RATE", "SAMPLED_LOG_POSITION_RATE", "SAMPLED_SHIPPING_THROUGHPUT"]
+    siteHeaders = ["Secondary\nSite ID", "Secondary\nSite Name", "Services", "Max. Log\nPosition Lag", "Max. Log\nTime Lag (s)", "Shipping\nThroughput (B/s)", "Full Replica\nRate (B/s)", "Delta Replica\nRate (B/s)", "Sampled Log\nPositions/s", "Sampled Shipping\nThroughput (B/s)"]
+
+    def __init__(self):
+        self.previous = {}
 
-            if sapcontrol:
-                print "SAPCONTROL-OK: <end>"
+    @staticmethod
+    def rate(size, duration):
+        if size is None or not duration or duration <= 0:
+            return None
+        return int(round(size * 1000000.0 / duration))
 
-            return ServiceStatus.NoHSR
+    @staticmethod
+    def lag(last, shipped):
+        if last is None or shipped is None:
+            return None
+        return max(last - shipped, 0)
+
+    # returns (services, sites): one metrics dict per row of config and the metrics per secondary site id
+    def sample(self, config, sampleTime = None):
+        sampleTime = sampleTime or time.time()
+        services = []
+        sites = collections.OrderedDict()
+        current = {}
+
+        for row in config:
+            v = dict((k, rawValue(row, k)) for k in ["LAST_LOG_POSITION", "SHIPPED_LOG_POSITION", "LAST_LOG_POSITION_TIME", "SHIPPED_LOG_POSITION_TIME", "SHIPPED_LOG_BUFFERS_SIZE", "SHIPPED_LOG_BUFFERS_DURATION", "SHIPPED_FULL_REPLICA_SIZE", "SHIPPED_FULL_REPLICA_DURATION", "SHIPPED_DELTA_REPLICA_SIZE", "SHIPPED_DELTA_REPLICA_DURATION"])
+            m = collections.OrderedDict()
+            m["LOG_POSITION_LAG"] = ReplicationMetrics.lag(v["LAST_LOG_POSITION"], v["SHIPPED_LOG_POSITION"])
+            timeLag = None
+            if v["LAST_LOG_POSITION_TIME"] > 0 and v["SHIPPED_LOG_POSITION_TIME"] > 0:
+                timeLag = round(ReplicationMetrics.lag(v["LAST_LOG_POSITION_TIME"], v["SHIPPED_LOG_POSITION_TIME"]) / 1000000.0, 6)
+            m["LOG_TIME_LAG"] = timeLag
+            m["SHIPPING_THROUGHPUT"] = ReplicationMetrics.rate(v["SHIPPED_LOG_BUFFERS_SIZE"], v["SHIPPED_LOG_BUFFERS_DURATION"])
+            m["FULL_REPLICA_RATE"] = ReplicationMetrics.rate(v["SHIPPED_FULL_REPLICA_SIZE"], v["SHIPPED_FULL_REPLICA_DURATION"])
+            m["DELTA_REPLICA_RATE"] = ReplicationMetrics.rate(v["SHIPPED_DELTA_REPLICA_SIZE"], v["SHIPPED_DELTA_REPLICA_DURATION"])
+
+            key = (row.get("HOST"), row.get("PORT"), row.get("SECONDARY_SITE_ID"))
+            previous = self.previous.get(key)
+            m["SAMPLED_LOG_POSITION_RATE"] = None
+            m["SAMPLED_SHIPPING_THROUGHPUT"] = None
+            if previous is not None and sampleTime > previous[0]:
+                seconds = sampleTime - previous[0]
+                for column, k in [("SAMPLED_LOG_POSITION_RATE", "SHIPPED_LOG_POSITION"), ("SAMPLED_SHIPPING_THROUGHPUT", "SHIPPED_LOG_BUFFERS_SIZE")]:
+                    if v[k] is not None and previous[1][k] is not None and v[k] >= previous[1][k]: # counters are reset on reconnect
+                        m[column] = int(round((v[k] - previous[1][k]) / seconds))
+            current[key] = (sampleTime, v)
+            services.append(m)
+
+            siteId = row.get("SECONDARY_SITE_ID")
+            if siteId not in sites:
+                sites[siteId] = {"SITE_NAME": row.get("SECONDARY_SITE_NAME"), "SERVICES": 0, "LOG_POSITION_LAG": None, "LOG_TIME_LAG": None, "sizes": [0, 0, 0, 0, 0, 0], "SAMPLED_LOG_POSITION_RATE": None, "SAMPLED_SHIPPING_THROUGHPUT": None}
+            site = sites[siteId]
+            site["SERVICES"] += 1
+            for column in ["LOG_POSITION_LAG", "LOG_TIME_LAG"]:
+                if m[column] is not None and (site[column] is None or m[column] > site[column]):
+                    site[column] = m[column]
+            for column in ["SAMPLED_LOG_POSITION_RATE", "SAMPLED_SHIPPING_THROUGHPUT"]:
+                if m[column] is not None:
+                    site[column] = (site[column] or 0) + m[column]
+            for i, k in enumerate(["SHIPPED_LOG_BUFFERS_SIZE", "SHIPPED_LOG_BUFFERS_DURATION", "SHIPPED_FULL_REPLICA_SIZE", "SHIPPED_FULL_REPLICA_DURATION", "SHIPPED_DELTA_REPLICA_SIZE", "SHIPPED_DELTA_REPLICA_DURATION"]):
+                site["sizes"][i] += v[k] or 0
+
+        self.previous = current
+
+        # per site: maximum lag of its services, throughput and transfer rates over all of its services
+        for siteId, site in sites.items():
+            sizes = site.pop("sizes")
+            m = collections.OrderedDict()
+            m["SITE_NAME"] = site["SITE_NAME"]
+            m["SERVICES"] = site["SERVICES"]
+            m["LOG_POSITION_LAG"] = site["LOG_POSITION_LAG"]
+            m["LOG_TIME_LAG"] = site["LOG_TIME_LAG"]
+            m["SHIPPING_THROUGHPUT"] = ReplicationMetrics.rate(sizes[0], sizes[1])
+            m["FULL_REPLICA_RATE"] = ReplicationMetrics.rate(sizes[2], sizes[3])
+            m["DELTA_REPLICA_RATE"] = ReplicationMetrics.rate(sizes[4], sizes[5])
+            m["SAMPLED_LOG_POSITION_RATE"] = site["SAMPLED_LOG_POSITION_RATE"]
+            m["SAMPLED_SHIPPING_THROUGHPUT"] = site["SAMPLED_SHIPPING_THROUGHPUT"]
+            sites[siteId] = m
+
+        return services, sites
+
+    # adds the service metrics as columns to the rows of config, returns the site metrics
+    def annotate(self, config, sampleTime = None):
+        services, sites = self.sample(config, sampleTime)
+        for row, m in zip(config, services):
+            for k, v in m.items():
+                row[k] = v
+        return sites
+
+    def printSites(self, sites, sapcontrol):
+        if sapcontrol:
+            for siteId, m in sites.items():
+                for k, v in m.items():
+                    if k != "SITE_NAME": # printed with the site status
+                        print "site/%s/%s=%s" % (siteId, k, "-" if v is None else v)
+        elif sites:
+            rows = []
+            for siteId, m in sites.items():
+                row = dict(m)
+                row["SITE_ID"] = siteId
+                rows.append(row)
+            print
+            TableRenderer(ReplicationMetrics.siteColumns, ReplicationMetrics.siteHeaders).render(rows)
+
+# Result of a status call bounded by a deadline, for callers that must not block on a hung nameserver (cluster manager).
+# With a deadline (seconds) the call runs in a daemon thread and result() waits for it until the deadline has passed at
+# most, then answers timeoutResult and calls abandon. The abandoned call cannot be interrupted and runs out in its thread.
+# Without a deadline the call runs in the calling thread.
+class StatusRequest(object):
+    def __init__(self, function, args = (), kwargs = {}, deadline = None, timeoutResult = None, abandon = None):
+        self.timeoutResult = timeoutResult
+        self.abandon = abandon
+        self.finished = threading.Event()
+        self.value = None
+        self.excInfo = None
+        self.deadline = None
+        if deadline is None:
+            self.run(function, args, kwargs)
+        else:
+            self.deadline = time.time() + deadline
+            thread = threading.Thread(target = self.run, args = (function, args, kwargs))
+            thread.daemon = True
+            thread.start()
 
-        ns = SystemReplicationStatusUtils.createTNSClient()
-        if not self.isNsActive(ns) or not self.isPrimarySystem():
+    def run(self, function, args, kwargs):
+        try:
+            self.value = function(*args, **kwargs)
+        except:
+            self.excInfo = sys.exc_info()
+        self.finished.set()
+
+    def done(self):
+        return self.finished.is_set()
+
+    def result(self):
+        if not self.finished.is_set():
+            self.finished.wait(max(self.deadline - time.time(), 0))
+            if not self.finished.is_set():
+                if self.abandon is not None:
+                    self.abandon()
+                    self.abandon = None
+                return self.timeoutResult
+        if self.excInfo is not None:
+            raise self.excInfo[0], self.excInfo[1], self.excInfo[2]
+        return self.value
+
+class SystemReplicationStatus(object):
+    def __init__(self, session = None):
+        self.session = session or SystemReplicationStatusSession()
+
+    # the session is still in use by a call that missed its deadline, continue with a new one
+    def abandonSession(self):
+        self.session = SystemReplicationStatusSession()
+
+    # The call gets the current session as its first argument, an abandoned call keeps using it and not its replacement.
+    # The session is reset first: an instance kept by the caller probes the nameserver again on every call and does not
+    # answer from the probe results of an earlier one.
+    def request(self, function, args, kwargs, deadline, timeoutResult = ([], ServiceStatus.Unknown)):
+        self.session.reset()
+        return StatusRequest(function, (self.session,) + tuple(args), kwargs, deadline, timeoutResult, self.abandonSession)
+
+    # filters: host, database and service as for getLandscapeConfigurationUpdatedVersion, columns: the columns to show
+    def getStatusAndPrint(self, longFormat, site, sapcontrol, requestSecondaryActiveStatus = True, local = False, streaming = False, outputFormat = None, metrics = None, filters = None, columns = None):
+        if outputFormat:
+            return self.getStatusAndWrite(outputFormat, site, requestSecondaryActiveStatus, local, metrics = metrics, filters = filters, columns = columns)
+
+        self.session.reset() # probe again when the instance is reused
+
+        check = self.checkLocalSite()
+        if check is not None:
+            self.printLocalSiteCheck(check[1], sapcontrol)
+            return check[0]
+
+        format, names = self.getColumns(longFormat, metrics, columns)
+        projection = None
+        if not sapcontrol and not metrics: # sapcontrol prints every column, the metrics are derived from the raw columns
+            projection = format
+        config, status = self.__getLandscapeConfigurationUpdatedVersion(self.session, site, self.needsActiveStatus(requestSecondaryActiveStatus, projection), local, columns = projection, **(filters or {}))
+        if metrics:
+            siteMetrics = metrics.annotate(config)
+
+        with profilePhase("render"):
             if sapcontrol:
                 print "SAPCONTROL-OK: <begin>"
+                self.printSapcontrolRows(config)
             else:
-                print "this system is either not running or not primary system replication site"
+                self.printDictList(config, format, names, streaming)
+            if metrics:
+                metrics.printSites(siteMetrics, sapcontrol)
 
-            SystemReplicationStatusUtils.printLocalHSRInformation(sapcontrol)
+            rc = SystemReplicationStatusUtils.determineAndPrintOverallStatus(status, sapcontrol, self.session)
+            SystemReplicationStatusUtils.printLocalHSRInformation(sapcontrol, self.session)
 
             if sapcontrol:
                 print "SAPCONTROL-OK: <end>"
 
-            return ServiceStatus.Unknown
+        return rc
+
+    # same checks and status semantics as getStatusAndPrint, written as json, ndjson or csv
+    def getStatusAndWrite(self, outputFormat, site, requestSecondaryActiveStatus = True, local = False, stream = None, metrics = None, filters = None, columns = None):
+        writer = StructuredStatusWriter(outputFormat, stream)
+        self.session.reset()
 
-        if self.hasSecondaries() == 0:
-            if sapcontrol:
-                print "SAPCONTROL-OK: <begin>"
-            else:
-                print "there are no secondary sites attached"
+        check = self.checkLocalSite()
+        if check is not None and not self.getDRMode():
+            writer.writeOverall(*check)
+            writer.close()
+            return check[0]
 
-            SystemReplicationStatusUtils.printLocalHSRInformation(sapcontrol)
+        if check is not None:
+            rc, message = check
+        else:
+            projection = None
+            if not metrics:
+                projection = columns
+            config, status = self.__getLandscapeConfigurationUpdatedVersion(self.session, site, self.needsActiveStatus(requestSecondaryActiveStatus, projection), local, columns = projection, **(filters or {}))
+            siteMetrics = {}
+            if metrics:
+                siteMetrics = metrics.annotate(config)
+            with profilePhase("render"):
+                writer.writeServices(config, self.getColumns(True, metrics, columns)[0])
+                writer.writeSites(status, siteMetrics)
+            rc = SystemReplicationStatusUtils.determineOverallStatus(status, self.session)
+            message = None
+
+        with profilePhase("render"):
+            writer.writeOverall(rc, message)
+            writer.writeLocal(SystemReplicationStatusUtils.getLocalHSRInformation(self.session))
+            writer.close()
+        return rc
 
-            if sapcontrol:
-                print "SAPCONTROL-OK: <end>"
+    # The checks of the local site every status starts with: (ServiceStatus, message) if this system is no replication site,
+    # is not running or not the primary site or has no secondaries attached, else None.
+    def checkLocalSite(self, session = None):
+        session = session or self.session
+        if not self.getDRMode(session):
+            return ServiceStatus.NoHSR, "this system is not a system replication site"
+        if not session.isNsActive() or not self.isPrimarySystem(session):
+            return ServiceStatus.Unknown, "this system is either not running or not primary system replication site"
+        if self.hasSecondaries(session) == 0:
+            return ServiceStatus.NoHSR, "there are no secondary sites attached"
+        return None
+
+    # prints a failed checkLocalSite, a replication site also prints its local information
+    def printLocalSiteCheck(self, message, sapcontrol):
+        isSite = bool(self.getDRMode())
+        if sapcontrol:
+            print "SAPCONTROL-OK: <begin>"
+            if not isSite:
+                print "local_site_id=0"
+        else:
+            print message
 
-            return ServiceStatus.NoHSR
+        if isSite:
+            SystemReplicationStatusUtils.printLocalHSRInformation(sapcontrol, self.session)
 
-        config, status = self.getLandscapeConfigurationUpdatedVersion(site, requestSecondaryActiveStatus, local)
+        if sapcontrol:
+            print "SAPCONTROL-OK: <end>"
+
+    # SECONDARY_ACTIVE_STATUS costs the nameserver an extra round-trip to the secondaries, only ask for it when it is shown,
+    # the replication status does not depend on it
+    @staticmethod
+    def needsActiveStatus(requestSecondaryActiveStatus, columns):
+        return requestSecondaryActiveStatus and (columns is None or "SECONDARY_ACTIVE_STATUS" in columns)
+
+    def getColumns(self, longFormat, metrics = None, columns = None):
+        if columns:
+            return list(columns), list(columns)
 
-        isMultiDb = ConfigMgrPy.LayeredConfiguration('global.ini', ConfigMgrPy.READONLY).getStringValue("multidb", "mode") == "multidb"
+        isMultiDb = self.session.configuration.getStringValue("READONLY", "multidb", "mode") == "multidb"
 
         format = []
         names = []
@@ -172,112 +1200,209 @@ class SystemReplicationStatus(object):
             format.extend(["HOST", "PORT", "SERVICE_NAME", "VOLUME_ID", "SITE_ID", "SITE_NAME", "SECONDARY_HOST",  "SECONDARY_PORT",  "SECONDARY_SITE_ID",  "SECONDARY_SITE_NAME",  "SECONDARY_ACTIVE_STATUS",  "REPLICATION_MODE",  "REPLICATION_STATUS",  "REPLICATION_STATUS_DETAILS"])
             names.extend(["Host", "Port", "Service Name", "Volume ID", "Site ID", "Site Name", "Secondary\nHost", "Secondary\nPort", "Secondary\nSite ID", "Secondary\nSite Name", "Secondary\nActive Status", "Replication\nMode", "Replication\nStatus", "Replication\nStatus Details"])
 
-        if sapcontrol:
-            print "SAPCONTROL-OK: <begin>"
-            for l in config:
-                for k, v in l.items():
-                    print "service/" + l["HOST"] + "/" + str(l["PORT"]) + "/" + k + "=" + str(v)
-        else:
-            self.printDictList(config, format, names)
-
-        rc = SystemReplicationStatusUtils.determineAndPrintOverallStatus(status, sapcontrol)
-        SystemReplicationStatusUtils.printLocalHSRInformation(sapcontrol)
+        if metrics:
+            format.extend(ReplicationMetrics.serviceColumns)
+            if not longFormat:
+                names.extend(ReplicationMetrics.serviceHeaders)
+
+        return format, names
+
+    def printSapcontrolRows(self, config):
+        for l in config:
+            for k, v in l.items():
+                if v is None:
+                    v = "-"
+                print "service/" + l["HOST"] + "/" + str(l["PORT"]) + "/" + k + "=" + str(v)
+
+    # Keeps the session (and its nameserver client) open and polls the replication status every interval seconds.
+    # Only rows that changed since the previous poll (keyed by HOST, PORT, SECONDARY_SITE_ID) and changes of the
+    # overall status are printed. Every poll starts with the checks of the local site, their message is printed when it
+    # changed and the rows are printed in full once there is a replication status again.
+    def watchStatus(self, interval, longFormat, site, sapcontrol, requestSecondaryActiveStatus = True, local = False, iterations = None, metrics = None, filters = None, columns = None):
+        previousRows = {}
+        previousStatus = None
+        rc = ServiceStatus.Unknown
+        n = 0
 
-        if sapcontrol:
-            print "SAPCONTROL-OK: <end>"
+        try:
+            while True:
+                self.session.reset()
+                check = self.checkLocalSite()
+                if check is not None:
+                    rc = check[0]
+                    if check != previousStatus:
+                        with profilePhase("render"):
+                            if not sapcontrol:
+                                print datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+                            self.printLocalSiteCheck(check[1], sapcontrol)
+                            if not sapcontrol:
+                                print
+                            sys.stdout.flush()
+                    previousRows = {}
+                    previousStatus = check
+                    n += 1
+                    if iterations is not None and n >= iterations:
+                        break
+                    time.sleep(interval)
+                    continue
+
+                format, names = self.getColumns(longFormat, metrics, columns) # only reads global.ini again after it changed
+                projection = None
+                if not sapcontrol and not metrics:
+                    projection = format + [c for c in ["HOST", "PORT", "SECONDARY_SITE_ID"] if c not in format] # the row key
+                config, status = self.__getLandscapeConfigurationUpdatedVersion(self.session, site, self.needsActiveStatus(requestSecondaryActiveStatus, projection), local, columns = projection, **(filters or {}))
+                if metrics:
+                    metrics.annotate(config)
+
+                rows = {}
+                changed = []
+                for row in config:
+                    key = (row["HOST"], row["PORT"], row["SECONDARY_SITE_ID"])
+                    if sapcontrol:
+                        values = sorted(row.items())
+                    else:
+                        values = [row.get(c, "?") for c in format]
+                    rows[key] = values
+                    if previousRows.get(key) != values:
+                        changed.append(row)
+                removed = sorted(key for key in previousRows if key not in rows)
+
+                rc = SystemReplicationStatusUtils.determineOverallStatus(status, self.session)
+                if isinstance(status, int):
+                    siteStatus = status
+                else:
+                    siteStatus = dict((id, st["REPLICATION_STATUS"]) for id, st in status.items())
+                statusChanged = (siteStatus, rc) != previousStatus
+
+                if changed or removed or statusChanged:
+                    with profilePhase("render"):
+                        if sapcontrol:
+                            print "SAPCONTROL-OK: <begin>"
+                            self.printSapcontrolRows(changed)
+                            for key in removed:
+                                print "service/%s/%s/REMOVED_SECONDARY_SITE_ID=%s" % key
+                        else:
+                            print datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+                            if changed:
+                                self.printDictList(changed, format, names)
+                            for key in removed:
+                                print "removed: host %s port %s secondary site %s" % key
+                        if statusChanged:
+                            SystemReplicationStatusUtils.determineAndPrintOverallStatus(status, sapcontrol, self.session)
+                        if sapcontrol:
+                            print "SAPCONTROL-OK: <end>"
+                        else:
+                            print
+                        sys.stdout.flush()
+
+                previousRows = rows
+                previousStatus = (siteStatus, rc)
+                n += 1
+                if iterations is not None and n >= iterations:
+                    break
+                time.sleep(interval)
+        except KeyboardInterrupt:
+            pass
 
         return rc
 
-    def isNsActive(self, ns):
-        ns.setNoRetries()
-        nsActive = False
-
+    # appends the status of every secondary service to history (a StatusHistory) every interval seconds
+    def sampleHistory(self, history, interval, site = None, requestSecondaryActiveStatus = True, local = False, iterations = None, filters = None):
+        n = 0
+        history.open()
         try:
-            ns.storeTrees([]) # force call to nameserver, else ns.getLandscapeConfiguration() could guess config from obsolete shared memory
-            nsActive = True
-        except:
-            try:
-                ns.useMasterNameServer(True) # directly connect to master if this script is executed on a stopped slave host
-                ns.storeTrees([])
-                nsActive = True
-            except:
-                pass
-
-        return nsActive
-
-    def getDRMode(self):
+            while True:
+                self.session.reset()
+                config, status = self.__getLandscapeConfigurationUpdatedVersion(self.session, site, self.needsActiveStatus(requestSecondaryActiveStatus, StatusHistory.sampleColumns), local, columns = StatusHistory.sampleColumns, **(filters or {}))
+                history.append(config)
+                n += 1
+                if iterations is not None and n >= iterations:
+                    break
+                time.sleep(interval)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            history.close()
+        return 0
+
+    # returns (services, sites) as computed by ReplicationMetrics.sample, pass the same metrics object on every call
+    # to get the rates between successive samples
+    def getReplicationMetrics(self, site, requestSecondaryActiveStatus = True, local = False, metrics = None):
+        config, status = self.getLandscapeConfigurationUpdatedVersion(site, requestSecondaryActiveStatus, local)
+        services, sites = (metrics or ReplicationMetrics()).sample(config)
+        result = []
+        for row, m in zip(config, services):
+            service = collections.OrderedDict((k, row[k]) for k in ["DATABASE", "HOST", "PORT", "SERVICE_NAME", "SECONDARY_SITE_ID"] if k in row)
+            service.update(m)
+            result.append(service)
+        return result, sites
+
+    def isNsActive(self, ns = None):
+        if ns is None or ns is self.session.ns:
+            return self.session.isNsActive()
+        return SystemReplicationStatusSession(ns).isNsActive()
+
+    def getDRMode(self, session = None):
+        session = session or self.session
         try:
-            ns = SystemReplicationStatusUtils.createTNSClient()
-            if self.isNsActive(ns):
-                return ns.getDRMode().upper()
+            if session.isNsActive():
+                return session.getDRMode()
             else:
                 return ""
         except:
             return ""
 
-    def isPrimarySystem(self):
+    def isPrimarySystem(self, session = None):
+        session = session or self.session
         try:
-            ns = SystemReplicationStatusUtils.createTNSClient()
-            if self.isNsActive(ns):
-                return ns.getSystemReplicationInfo()["mode"].lower() == "primary"
+            if session.isNsActive():
+                return session.getSystemReplicationInfo()["mode"].lower() == "primary"
         except:
             return False
 
-    def hasSecondaries(self):
+    def hasSecondaries(self, session = None):
+        session = session or self.session
         try:
-            ns = SystemReplicationStatusUtils.createTNSClient()
-            if self.isNsActive(ns):
-                return ns.getSystemReplicationInfo()["numConsumers"]
+            if session.isNsActive():
+                return session.getSystemReplicationInfo()["numConsumers"]
         except:
             return 0
 
-    def getSystemReplicationStatus(self, requestSecondaryActiveStatus = True, local = False):
-        ns = SystemReplicationStatusUtils.createTNSClient()
-        host = ""
+    # the host is passed on to the nameserver, which then only returns the services of that host
+    def getSystemReplicationStatus(self, requestSecondaryActiveStatus = True, local = False, host = None, session = None):
+        session = session or self.session
         if local:
-            host = ns.getServiceHost()
-        return ns.getSystemReplicationStatus(requestSecondaryActiveStatus, host)
+            host = session.getServiceHost()
+        return session.getSystemReplicationStatus(requestSecondaryActiveStatus, host or "")
+
+    # filters and columns as for LandscapeModel, the host filter is pushed down to the nameserver
+    def getLandscapeModel(self, requestSecondaryActiveStatus = True, local = False, site = None, host = None, database = None, service = None, columns = None, session = None):
+        rows = self.getSystemReplicationStatus(requestSecondaryActiveStatus, local, host, session)
+        with profilePhase("model"):
+            model = LandscapeModel(rows, site, host, database, service, columns)
+        profileCount("rowsFetched", len(rows))
+        profileCount("rows", len(model.table))
+        profileCount("columns", len(model.table.columns))
+        return model
 
     # Do not touch the signature and return format of this method. It is used by external scripts such as cluster manager
     # Please use: getLandscapeConfigurationUpdatedVersion
     def getLandscapeConfiguration(self, site):
+        return self.getLandscapeConfigurationAsync(site).result()
+
+    # StatusRequest answering getLandscapeConfiguration, ([], ServiceStatus.Unknown) if it misses the deadline (seconds)
+    def getLandscapeConfigurationAsync(self, site, deadline = None):
+        return self.request(self.__getLandscapeConfiguration, (site,), {}, deadline)
+
+    def __getLandscapeConfiguration(self, session, site):
         status = {}
         config = []
 
         try:
-            ns = SystemReplicationStatusUtils.createTNSClient()
-            if self.isNsActive(ns):
-                config = self.getSystemReplicationStatus()
-                config = [row for row in config if not row['VOLUME_ID'] == 0] # do not show standy services as they do not replicate anything
-                config.sort(lambda a, b:cmp(a['SITE_ID'], b['SITE_ID']))
-
-                if site != None:
-                    config2 = []
-                    for row in config:
-                        if row["SECONDARY_HOST"].lower() in ["not mapped", "not_mapped"]:
-                            continue
-                        if row["SECONDARY_SITE_NAME"].lower() == site.lower():
-                            config2.append(row)
-                    config = config2
-
-                for row in config:
-                    if row['REPLICATION_STATUS'] == "STOPPED" or row['REPLICATION_STATUS'] == "TENANTCOPY":
-                        continue
-                    if row["SECONDARY_HOST"].lower() in ["not mapped", "not_mapped"]:
-                        status['NOT MAPPED']= ServiceStatus.Error
-                        continue
-                    if not status.has_key(row["SECONDARY_SITE_NAME"]):
-                        status[row["SECONDARY_SITE_NAME"]] = ServiceStatus.Active
-                    service_status = ServiceStatus.fromStr(row['REPLICATION_STATUS'], row['SECONDARY_ACTIVE_STATUS'])
-                    if service_status < status[row["SECONDARY_SITE_NAME"]]:
-                        status[row["SECONDARY_SITE_NAME"]] = service_status
-
-                    for k, v in row.items():
-                        if k.endswith("_TIME"):
-                            if v > 0:
-                                row[k] = datetime.datetime.fromtimestamp(int(v)/1000.0/1000.0).strftime('%Y-%m-%d %H:%M:%S.%f')
-                            else:
-                                row[k] = "-"
+            if session.isNsActive():
+                model = self.getLandscapeModel(site = site, session = session)
+                config = [row.toDict() for row in model.getRows()]
+                status = model.getSiteNameStatus()
             else:
                 config = []
                 status = ServiceStatus.Error
@@ -290,49 +1415,24 @@ class SystemReplicationStatus(object):
         return (config, status)
 
     # This version is internaly used  by systemReplicationStatus.py script
-    def getLandscapeConfigurationUpdatedVersion(self, site, requestSecondaryActiveStatus = True, local = False):
+    # host, database and service restrict the rows like site, columns restricts the fields of the rows
+    def getLandscapeConfigurationUpdatedVersion(self, site, requestSecondaryActiveStatus = True, local = False, host = None, database = None, service = None, columns = None):
+        return self.getLandscapeConfigurationUpdatedVersionAsync(site, requestSecondaryActiveStatus, local, host, database, service, columns).result()
+
+    # StatusRequest answering getLandscapeConfigurationUpdatedVersion, ([], ServiceStatus.Unknown) if it misses the deadline (seconds)
+    def getLandscapeConfigurationUpdatedVersionAsync(self, site, requestSecondaryActiveStatus = True, local = False, host = None, database = None, service = None, columns = None, deadline = None):
+        return self.request(self.__getLandscapeConfigurationUpdatedVersion, (site, requestSecondaryActiveStatus, local, host, database, service, columns), {}, deadline)
+
+    # also used directly by the callers that probed the session already
+    def __getLandscapeConfigurationUpdatedVersion(self, session, site, requestSecondaryActiveStatus = True, local = False, host = None, database = None, service = None, columns = None):
         status = {}
         config = []
 
         try:
-            ns = SystemReplicationStatusUtils.createTNSClient()
-            if self.isNsActive(ns):
-                config = self.getSystemReplicationStatus(requestSecondaryActiveStatus, local)
-                config = [row for row in config if not row['VOLUME_ID'] == 0] # do not show standy services as they do not replicate anything
-                config.sort(lambda a, b:cmp(a['SITE_ID'], b['SITE_ID']))
-
-                if site != None:
-                    config2 = []
-                    for row in config:
-                        if row["SECONDARY_HOST"].lower() in ["not mapped", "not_mapped"]:
-                            continue
-                        if row["SECONDARY_SITE_NAME"].lower() == site.lower():
-                            config2.append(row)
-                    config = config2
-
-                for row in config:
-                    if row['REPLICATION_STATUS'] == "STOPPED" or row['REPLICATION_STATUS'] == "TENANTCOPY":
-                        continue
-                    if row["SECONDARY_HOST"].lower() in ["not mapped", "not_mapped"]:
-                        status['NOT MAPPED']= {"SECONDARY_SITE_NAME" : "ERROR",
-                         "REPLICATION_MODE" : "ERROR",
-                         "REPLICATION_STATUS" : ServiceStatus.Error}
-                        continue
-                    if not status.has_key(row["SECONDARY_SITE_ID"]):
-                        status[row["SECONDARY_SITE_ID"]] = {"SECONDARY_SITE_NAME" : row["SECONDARY_SITE_NAME"],
-                             "REPLICATION_MODE" : row["REPLICATION_MODE"],
-                             "SOURCE_SITE_ID" : row["SITE_ID"],
-                             "REPLICATION_STATUS" : ServiceStatus.Active}
-                    service_status = ServiceStatus.fromStr(row['REPLICATION_STATUS'], row['SECONDARY_ACTIVE_STATUS'])
-                    if service_status < status[row["SECONDARY_SITE_ID"]]["REPLICATION_STATUS"]:
-                        status[row["SECONDARY_SITE_ID"]]["REPLICATION_STATUS"] = service_status
-
-                    for k, v in row.items():
-                        if k.endswith("_TIME"):
-                            if v > 0:
-                                row[k] = datetime.datetime.fromtimestamp(int(v)/1000.0/1000.0).strftime('%Y-%m-%d %H:%M:%S.%f')
-                            else:
-                                row[k] = "-"
+            if session.isNsActive():
+                model = self.getLandscapeModel(requestSecondaryActiveStatus, local, site, host, database, service, columns, session)
+                config = model.getRows()
+                status = model.getSiteStatus()
             else:
                 config = []
                 status = ServiceStatus.Error
@@ -344,43 +1444,885 @@ class SystemReplicationStatus(object):
 
         return (config, status)
 
-    def printDictList(self, table, columns, headers):
-        l={} # max. column length
-        hr=1 # number of header rows
-        for c,h in zip(columns,headers):
-            hh=h.split('\n')
-            if len(hh)>hr: hr=len(hh)
-            for hhh in hh:
-                if c not in l:      l[c]=len(hhh)
-                elif len(hhh)>l[c]: l[c]=len(hhh)
-        for row in table:
-            for c in columns:
-                if c not in row:                        l_c=1
-                elif type(row[c]) in types.StringTypes: l_c=len(    row[c] )
-                else:                                   l_c=len(str(row[c]))
-                if l_c>l[c]: l[c]=l_c
-        print '|',
-        for i in range(hr):
-            for c,h in zip(columns,headers):
-                hh=h.split('\n')
-                if len(hh)>i: h=hh[i]
-                else:         h=''
-                print h.ljust(l[c])+' |',
-            print '\n|',
-        for c in columns:
-            print '-'*l[c]+' |',
+    # The overall status for health checks (--check), the return code of getStatusAndPrint: the same checks of the local
+    # site first, then the status semantics of getLandscapeConfigurationUpdatedVersion and determineOverallStatus. Skips
+    # SECONDARY_ACTIVE_STATUS (the status does not depend on it), the model, timestamp formatting and the local site
+    # information.
+    def checkStatus(self, site = None, local = False, host = None, database = None, service = None):
+        return self.checkStatusAsync(site, local, host, database, service).result()
+
+    # StatusRequest answering checkStatus, ServiceStatus.Unknown if it misses the deadline (seconds)
+    def checkStatusAsync(self, site = None, local = False, host = None, database = None, service = None, deadline = None):
+        return self.request(self.__checkStatus, (site, local, host, database, service), {}, deadline, ServiceStatus.Unknown)
+
+    def __checkStatus(self, session, site, local, host, database, service):
+        try:
+            check = self.checkLocalSite(session)
+            if check is not None:
+                return check[0]
+            rows = self.getSystemReplicationStatus(False, local, host, session)
+            overall = LandscapeModel.overallStatus(rows, site, host, database, service)
+            if overall is None:
+                return SystemReplicationStatusUtils.determineOverallStatus({}, session)
+            return overall
+        except Exception, exc:
+            traceback.print_exc()
+            return ServiceStatus.Error
+
+    def printDictList(self, table, columns, headers, streaming = False):
+        renderer = TableRenderer(columns, headers)
+        if streaming:
+            renderer.renderStreaming(table)
+        else:
+            renderer.render(table)
+
+# Renders a list of rows as the '|' separated text table. Every line is built with one join and written through
+# one buffered stream. render() sizes the columns to their content; renderStreaming() uses fixed widths and writes
+# the rows as they arrive, without a pass over the whole table first.
+class TableRenderer(object):
+    timeWidth = 26 # '%Y-%m-%d %H:%M:%S.%f'
+    defaultWidths = {"DATABASE": 8, "HOST": 16, "PORT": 5, "SERVICE_NAME": 16, "SITE_NAME": 12, "SECONDARY_HOST": 16, "SECONDARY_PORT": 5, "SECONDARY_SITE_NAME": 12, "REPLICATION_STATUS_DETAILS": 24}
+
+    def __init__(self, columns, headers, stream = None):
+        self.columns = columns
+        self.headers = [h.split('\n') for h in headers]
+        self.headerRows = max([len(hh) for hh in self.headers] + [1])
+        self.stream = stream or sys.stdout
+
+    def cells(self, row):
+        cells = []
+        for c in self.columns:
+            if c not in row:
+                cells.append(('?', True))
+            else:
+                v = row[c]
+                if type(v) in types.StringTypes:
+                    cells.append((v, True))
+                elif v is None:
+                    cells.append(('-', True))
+                else:
+                    cells.append((str(v), False))
+        return cells
+
+    def headerWidths(self):
+        return [max([len(h) for h in hh]) for hh in self.headers]
+
+    def fixedWidths(self):
+        widths = []
+        for c, w in zip(self.columns, self.headerWidths()):
+            if c.endswith("_TIME"):
+                w = max(w, TableRenderer.timeWidth)
+            widths.append(max(w, TableRenderer.defaultWidths.get(c, 0)))
+        return widths
+
+    def headerLines(self, widths):
+        lines = []
+        for i in range(self.headerRows):
+            cells = []
+            for hh, w in zip(self.headers, widths):
+                if len(hh) > i:
+                    cells.append(hh[i].ljust(w))
+                else:
+                    cells.append(''.ljust(w))
+            lines.append('| ' + ' | '.join(cells) + ' |')
+        lines.append('| ' + ' | '.join(['-' * w for w in widths]) + ' |')
+        return lines
+
+    def line(self, cells, widths):
+        return '| ' + ' | '.join([text.ljust(w) if left else text.rjust(w) for (text, left), w in zip(cells, widths)]) + ' |'
+
+    # lines are separated by ' \n' and the table ends with '\n', as printed by the former 'print x,' loop
+    def render(self, table):
+        widths = self.headerWidths()
+        rows = []
         for row in table:
-            print '\n|',
-            for c in columns:
-                if c not in row:                        print     '?'    .ljust(l[c])+' |',
-                elif type(row[c]) in types.StringTypes: print     row[c] .ljust(l[c])+' |',
-                else:                                   print str(row[c]).rjust(l[c])+' |',
+            cells = self.cells(row)
+            for i, (text, left) in enumerate(cells):
+                if len(text) > widths[i]:
+                    widths[i] = len(text)
+            rows.append(cells)
+
+        lines = self.headerLines(widths)
+        for cells in rows:
+            lines.append(self.line(cells, widths))
+        self.stream.write(' \n'.join(lines) + '\n')
+
+    def renderStreaming(self, rows, widths = None):
+        widths = widths or self.fixedWidths()
+        self.stream.write(' \n'.join(self.headerLines(widths)))
+        for row in rows:
+            self.stream.write(' \n' + self.line(self.cells(row), widths))
+        self.stream.write('\n')
+
+# Results of SystemReplicationStatus queries, refreshed every ttl seconds by a background thread. Queries are answered
+# from the last result and only the first query of a key waits for the nameserver. Fetches are serialized, so they can
+# share one nameserver client, and keys not queried for idle refreshes are dropped.
+class LandscapeCache(object):
+    def __init__(self, ttl, idle = 10):
+        self.ttl = ttl
+        self.idle = idle
+        self.lock = threading.Lock() # entries
+        self.fetchLock = threading.Lock()
+        self.entries = {} # key -> [result, fetch, time of the last query]
+        self.refresher = None
+
+    def get(self, key, fetch):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                entry[2] = time.time()
+                return entry[0]
+        with self.fetchLock:
+            with self.lock:
+                entry = self.entries.get(key) # fetched by a concurrent first query meanwhile
+            if entry is None:
+                result = fetch()
+                with self.lock:
+                    entry = self.entries[key] = [result, fetch, time.time()]
+        self.startRefresher()
+        return entry[0]
+
+    def startRefresher(self):
+        with self.lock:
+            if self.refresher is None:
+                self.refresher = threading.Thread(target = self.refreshForever)
+                self.refresher.daemon = True
+                self.refresher.start()
+
+    def refreshForever(self):
+        while True:
+            time.sleep(self.ttl)
+            self.refresh()
+
+    def refresh(self):
+        with self.lock:
+            now = time.time()
+            for key, entry in self.entries.items():
+                if now - entry[2] > self.idle * self.ttl:
+                    del self.entries[key]
+            entries = self.entries.items()
+        for key, entry in entries:
+            try:
+                with self.fetchLock:
+                    result = entry[1]()
+            except Exception, exc: # keep answering the previous result
+                traceback.print_exc()
+                continue
+            with self.lock:
+                if key in self.entries:
+                    self.entries[key][0] = result
+
+# Lets serve_forever of server return on SIGTERM. SystemExit raised by the handler would be swallowed by SocketServer
+# when it interrupts the start of a request thread, and shutdown() waits for serve_forever, so it runs in its own thread.
+def stopOnSigterm(server):
+    def stop(signum, frame):
+        thread = threading.Thread(target = server.shutdown)
+        thread.daemon = True
+        thread.start()
+    signal.signal(signal.SIGTERM, stop)
+
+def getStatusCacheSocketPath():
+    path = os.environ.get("SR_STATUS_CACHE_SOCKET")
+    if path:
+        return path
+    return "/tmp/.systemReplicationStatus_%s_%d.sock" % (os.environ.get("SAPSYSTEMNAME", ""), os.getuid())
+
+# Local daemon answering getLandscapeConfiguration/getLandscapeConfigurationUpdatedVersion from memory.
+# Protocol: one request line repr((method, args)), one response line repr(result); both are python literals.
+class StatusCacheDaemon(object):
+    methods = ["getLandscapeConfiguration", "getLandscapeConfigurationUpdatedVersion"]
+
+    def __init__(self, socketPath = None, ttl = 5.0):
+        self.socketPath = socketPath or getStatusCacheSocketPath()
+        self.cache = LandscapeCache(ttl)
+        self.sysRepStatus = SystemReplicationStatus()
+
+    # the queries of the module functions with their default arguments, fetched before the socket is opened
+    defaultQueries = [("getLandscapeConfiguration", (None,)), ("getLandscapeConfigurationUpdatedVersion", (None, True, False))]
+
+    def query(self, method, args):
+        if method not in StatusCacheDaemon.methods:
+            return None
+        def fetch():
+            # fetches are serialized by the cache, so all of them can share one nameserver client
+            self.sysRepStatus.session.reset()
+            config, status = getattr(self.sysRepStatus, method)(*args)
+            return toDicts(config), status
+        return self.cache.get((method,) + tuple(args), fetch)
+
+    def serve(self):
+        import SocketServer, ast # only needed by the server modes
+        daemon = self
+
+        class Handler(SocketServer.StreamRequestHandler):
+            def handle(self):
+                line = self.rfile.readline()
+                if not line:
+                    return # availability probe
+                try:
+                    method, args = ast.literal_eval(line)
+                    result = daemon.query(method, tuple(args))
+                except Exception, exc:
+                    traceback.print_exc()
+                    result = None
+                self.wfile.write(repr(result) + "\n")
+
+        class Server(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+            daemon_threads = True
+
+        if os.path.exists(self.socketPath):
+            if StatusCacheClient(self.socketPath).isAvailable():
+                print "status cache daemon is already running on %s" % self.socketPath
+                return 1
+            os.unlink(self.socketPath) # stale socket of a daemon that was killed
+
+        for method, args in StatusCacheDaemon.defaultQueries:
+            self.query(method, args)
+
+        oldUmask = os.umask(0077)
+        try:
+            server = Server(self.socketPath, Handler)
+        finally:
+            os.umask(oldUmask)
+
+        stopOnSigterm(server)
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
+            os.unlink(self.socketPath)
+        return 0
+
+class StatusCacheClient(object):
+    def __init__(self, socketPath = None, timeout = 2.0):
+        self.socketPath = socketPath or getStatusCacheSocketPath()
+        self.timeout = timeout
+
+    def isAvailable(self):
+        import socket # not needed by the status output of the command line
+        try:
+            sock = self.__connect()
+            sock.close()
+            return True
+        except (socket.error, OSError):
+            return False
+
+    def __connect(self):
+        # only talk to a socket owned by ourselves
+        st = os.stat(self.socketPath)
+        if not stat.S_ISSOCK(st.st_mode) or st.st_uid != os.getuid():
+            raise OSError("%s is not a status cache socket" % self.socketPath)
+        import socket
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self.socketPath)
+        return sock
+
+    # returns None if the daemon is not reachable or could not answer the query
+    def query(self, method, *args):
+        if not os.path.exists(self.socketPath):
+            return None
+        import socket, ast
+        try:
+            sock = self.__connect()
+            try:
+                sock.sendall(repr((method, args)) + "\n")
+                chunks = []
+                while True:
+                    chunk = sock.recv(65536)
+                    if not chunk:
+                        break
+                    chunks.append(chunk)
+            finally:
+                sock.close()
+            return ast.literal_eval("".join(chunks))
+        except (socket.error, OSError, ValueError, SyntaxError):
+            return None
+
+# Prometheus/OpenMetrics text exposition of the replication status, served on /metrics by --exporter.
+# Collections are cached for interval seconds, concurrent scrapes within that time share one nameserver fetch.
+class MetricsExporter(object):
+    # (metric, status column, help) exported per service as counters
+    counters = [
+        ("hana_sr_secondary_reconnect_count_total", "SECONDARY_RECONNECT_COUNT", "Reconnects of the secondary service"),
+        ("hana_sr_secondary_failover_count_total", "SECONDARY_FAILOVER_COUNT", "Failovers of the secondary service"),
+        ("hana_sr_shipped_log_buffers_count_total", "SHIPPED_LOG_BUFFERS_COUNT", "Shipped log buffers"),
+        ("hana_sr_shipped_log_buffers_size_bytes_total", "SHIPPED_LOG_BUFFERS_SIZE", "Size of the shipped log buffers"),
+        ("hana_sr_shipped_log_buffers_duration_microseconds_total", "SHIPPED_LOG_BUFFERS_DURATION", "Time spent shipping log buffers"),
+        ("hana_sr_shipped_full_replica_count_total", "SHIPPED_FULL_REPLICA_COUNT", "Shipped full replicas"),
+        ("hana_sr_shipped_full_replica_size_bytes_total", "SHIPPED_FULL_REPLICA_SIZE", "Size of the shipped full replicas"),
+        ("hana_sr_shipped_delta_replica_count_total", "SHIPPED_DELTA_REPLICA_COUNT", "Shipped delta replicas"),
+        ("hana_sr_shipped_delta_replica_size_bytes_total", "SHIPPED_DELTA_REPLICA_SIZE", "Size of the shipped delta replicas"),
+    ]
+    # (metric, status column, help) exported per service as gauges
+    gauges = [
+        ("hana_sr_last_full_replica_size_bytes", "SHIPPED_LAST_FULL_REPLICA_SIZE", "Size of the last shipped full replica"),
+        ("hana_sr_last_delta_replica_size_bytes", "SHIPPED_LAST_DELTA_REPLICA_SIZE", "Size of the last shipped delta replica"),
+    ]
+
+    def __init__(self, address = "127.0.0.1", port = 9668, interval = 15.0):
+        self.address = address
+        self.port = port
+        self.cache = LandscapeCache(interval)
+        self.sysRepStatus = SystemReplicationStatus()
+
+    @staticmethod
+    def labels(serviceLabels = {}, **labels):
+        labels.update(serviceLabels)
+        escaped = []
+        for k in sorted(labels):
+            v = str(labels[k]).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+            escaped.append('%s="%s"' % (k, v))
+        return "{" + ",".join(escaped) + "}"
+
+    def collect(self):
+        start = time.time()
+        nsCalls = self.sysRepStatus.session.nsCalls
+        configuration = self.sysRepStatus.session.configuration
+        loads, loadTime = configuration.loads, configuration.loadTime
+        config, status = self.sysRepStatus.getLandscapeConfigurationUpdatedVersion(None, False) # resets the session
+        check = self.sysRepStatus.checkLocalSite() # as checkStatus does, answered from the probes of the call above
+        if check is not None:
+            config, status, overall = [], check[0], check[0]
+        else:
+            overall = SystemReplicationStatusUtils.determineOverallStatus(status, self.sysRepStatus.session)
+        services, sites = ReplicationMetrics().sample(config)
+
+        lines = []
+        def family(name, type, help):
+            lines.append("# HELP %s %s" % (name, help))
+            lines.append("# TYPE %s %s" % (name, type))
+
+        serviceLabels = []
+        for row in config:
+            serviceLabels.append({"database": row.get("DATABASE", ""), "host": row["HOST"], "port": row["PORT"], "service": row["SERVICE_NAME"],
+                "secondary_site_id": row["SECONDARY_SITE_ID"], "secondary_site_name": row["SECONDARY_SITE_NAME"], "mode": row["REPLICATION_MODE"]})
+
+        family("hana_sr_service_replication_status", "gauge", "Replication status of the service, %s" % ", ".join("%d=%s" % (i, ServiceStatus.toStr(i)) for i in range(ServiceStatus.NoHSR, ServiceStatus.Active + 1)))
+        for row, labels in zip(config, serviceLabels):
+            if row["REPLICATION_STATUS"] in ("STOPPED", "TENANTCOPY"): # not aggregated into the site status either
+                continue
+            lines.append("hana_sr_service_replication_status%s %d" % (MetricsExporter.labels(labels), ServiceStatus.fromStr(row["REPLICATION_STATUS"], None)))
+
+        for name, column, help in MetricsExporter.counters:
+            family(name, "counter", help)
+            for row, labels in zip(config, serviceLabels):
+                v = rawValue(row, column)
+                if v is not None:
+                    lines.append("%s%s %s" % (name, MetricsExporter.labels(labels), v))
+
+        for name, column, help in MetricsExporter.gauges:
+            family(name, "gauge", help)
+            for row, labels in zip(config, serviceLabels):
+                v = rawValue(row, column)
+                if v is not None:
+                    lines.append("%s%s %s" % (name, MetricsExporter.labels(labels), v))
+
+        family("hana_sr_log_position_lag", "gauge", "Last log position minus shipped log position")
+        for m, labels in zip(services, serviceLabels):
+            if m["LOG_POSITION_LAG"] is not None:
+                lines.append("hana_sr_log_position_lag%s %s" % (MetricsExporter.labels(labels), m["LOG_POSITION_LAG"]))
+
+        family("hana_sr_site_replication_status", "gauge", "Replication status of the secondary site, same values as the service status")
+        if not isinstance(status, int):
+            for id, st in status.items():
+                lines.append("hana_sr_site_replication_status%s %d" % (MetricsExporter.labels(site_id = id, site_name = st["SECONDARY_SITE_NAME"], mode = st["REPLICATION_MODE"]), st["REPLICATION_STATUS"]))
+
+        family("hana_sr_overall_replication_status", "gauge", "Overall system replication status as returned by systemReplicationStatus.py")
+        lines.append("hana_sr_overall_replication_status %d" % overall)
+
+        family("hana_sr_exporter_collect_duration_seconds", "gauge", "Duration of the last collection")
+        lines.append("hana_sr_exporter_collect_duration_seconds %.6f" % (time.time() - start))
+        family("hana_sr_exporter_nameserver_calls", "gauge", "Nameserver round-trips of the last collection")
+        lines.append("hana_sr_exporter_nameserver_calls %d" % (self.sysRepStatus.session.nsCalls - nsCalls))
+        family("hana_sr_exporter_config_load_seconds", "gauge", "Time spent loading global.ini during the last collection")
+        lines.append("hana_sr_exporter_config_load_seconds %.6f" % (configuration.loadTime - loadTime))
+        family("hana_sr_exporter_config_loads", "gauge", "Configuration layers opened during the last collection")
+        lines.append("hana_sr_exporter_config_loads %d" % (configuration.loads - loads))
+        return "\n".join(lines) + "\n"
+
+    def getMetrics(self):
+        return self.cache.get("metrics", self.collect)
+
+    def serve(self):
+        import BaseHTTPServer, SocketServer # only needed by the server modes
+        exporter = self
+
+        class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                try:
+                    body = exporter.getMetrics()
+                except Exception, exc:
+                    traceback.print_exc()
+                    self.send_error(500)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+            daemon_threads = True
+
+        server = Server((self.address, self.port), Handler)
+        stopOnSigterm(server)
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
+        return 0
+
+# Collects the replication status of several HANA systems concurrently. NameServerPy always talks to the instance of
+# the environment it runs in, so every system is queried by its own child process (for example "su - <sid>adm -c ..."
+# or "ssh <host> ...") that prints the --format=json document of this script. A command has to pass --format=json on
+# to the script itself, either literally or as the {format} placeholder, which can also be placed inside quotes:
+#   su - <sid>adm -c "python systemReplicationStatus.py {format}"
+# Login banners before the document and anything written to stderr do not matter, the last stderr line is reported
+# if no document is found. At most maxWorkers systems run at the same time and a system that does not answer within
+# timeout seconds is killed and reported as UNKNOWN.
+class MultiSystemCollector(object):
+    def __init__(self, systems, timeout = 30.0, maxWorkers = 8):
+        self.systems = systems # list of (name, command); without a command this script is run locally
+        self.timeout = timeout
+        self.maxWorkers = maxWorkers
+
+    @staticmethod
+    def readSystems(path):
+        systems = []
+        for n, line in enumerate(open(path)):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            parts = line.split(None, 1)
+            if len(parts) > 1 and "{format}" not in parts[1] and "--format=json" not in parts[1]:
+                raise ValueError("%s line %d: the command of %s needs --format=json or {format}" % (path, n + 1, parts[0]))
+            systems.append((parts[0], parts[1] if len(parts) > 1 else None))
+        return systems
+
+    def command(self, command):
+        if not command:
+            return [sys.executable, os.path.abspath(__file__), "--format=json"]
+        return ["/bin/sh", "-c", command.replace("{format}", "--format=json")]
+
+    def start(self, name, command):
+        import subprocess, tempfile # only needed by --systems
+        output = tempfile.TemporaryFile()
+        errors = tempfile.TemporaryFile()
+        process = subprocess.Popen(self.command(command), stdout = output, stderr = errors, preexec_fn = os.setsid)
+        return {"name": name, "process": process, "output": output, "errors": errors, "start": time.time()}
+
+    # the json document of the script, skipping anything printed before it (login banners)
+    @staticmethod
+    def parseDocument(output):
+        import json
+        lines = output.splitlines()
+        for i, line in enumerate(lines):
+            if line.startswith("{"):
+                try:
+                    return json.loads("\n".join(lines[i:]))
+                except ValueError:
+                    pass
+        raise ValueError("no json document")
+
+    def finish(self, job, timedOut):
+        record = collections.OrderedDict()
+        record["SYSTEM"] = job["name"]
+        record["SECONDS"] = round(time.time() - job["start"], 3)
+        record["SITES"] = None
+        record["ERROR"] = None
+        job["output"].seek(0)
+        output = job["output"].read()
+        job["output"].close()
+        job["errors"].seek(0)
+        errors = job["errors"].read().strip()
+        job["errors"].close()
+
+        if timedOut:
+            overall = ServiceStatus.Unknown
+            record["ERROR"] = "no answer within %s seconds" % self.timeout
+        else:
+            try:
+                document = MultiSystemCollector.parseDocument(output)
+                overall = document["overall"]["STATUS_CODE"]
+                record["SITES"] = " ".join("%s:%s" % (site["SITE_NAME"], site["REPLICATION_STATUS"]) for site in document.get("sites", []))
+                if "MESSAGE" in document["overall"]:
+                    record["ERROR"] = document["overall"]["MESSAGE"]
+            except (ValueError, KeyError, TypeError):
+                overall = ServiceStatus.Error
+                lastLine = (errors or output.strip()).splitlines()[-1] if (errors or output.strip()) else "no output"
+                record["ERROR"] = "exit code %s: %s" % (job["process"].returncode, lastLine)
+        record["REPLICATION_STATUS"] = ServiceStatus.toStr(overall)
+        record["STATUS_CODE"] = overall
+        return record
+
+    # returns the per system records in the order of self.systems and the worst overall status of all systems
+    def collect(self):
+        pending = list(enumerate(self.systems))
+        running = []
+        records = [None] * len(self.systems)
+
+        while pending or running:
+            while pending and len(running) < self.maxWorkers:
+                i, (name, command) = pending.pop(0)
+                running.append((i, self.start(name, command)))
+
+            time.sleep(0.05)
+            for i, job in list(running):
+                timedOut = False
+                if job["process"].poll() is None:
+                    if time.time() - job["start"] < self.timeout:
+                        continue
+                    try:
+                        os.killpg(job["process"].pid, signal.SIGKILL)
+                    except OSError:
+                        pass
+                    job["process"].wait()
+                    timedOut = True
+                records[i] = self.finish(job, timedOut)
+                running.remove((i, job))
+
+        overall = ServiceStatus.Active
+        for record in records:
+            if record["STATUS_CODE"] < overall:
+                overall = record["STATUS_CODE"]
+        return records, overall
+
+    def collectAndPrint(self, outputFormat = None):
+        records, overall = self.collect()
+        if outputFormat:
+            writer = StructuredStatusWriter(outputFormat)
+            writer.writeRecords("systems", "system", records)
+            writer.writeOverall(overall)
+            writer.close()
+        else:
+            TableRenderer(["SYSTEM", "REPLICATION_STATUS", "SITES", "SECONDS", "ERROR"], ["System", "Replication\nStatus", "Secondary Sites", "Seconds", "Error"]).render(records)
+            print
+            print 'overall system replication status:', ServiceStatus.toStr(overall)
+        return overall
+
+# Replication history for --sample and --trend. A history file holds the raw numbers of getSystemReplicationStatus
+# samples in fixed size records appended in time order, so it can be memory mapped and the records of a time window
+# found by binary search on the sample time instead of reading the whole file:
+#   header   headerFormat (magic, version, record size, key slot size, key slots, key slots in use), padded to headerSize
+#   keys     key slots of keySize bytes, each the tab separated keyColumns of one secondary service
+#   records  recordFormat: sample time (microseconds), key slot, replication status code (0: not aggregated), columns
+# Missing values are stored as -1. A file is rotated (path -> path.1 -> ... -> path.<files - 1>) before it grows beyond
+# maxBytes or when its key slots are used up, so the history never takes more than files * maxBytes.
+class StatusHistory(object):
+    magic = "SRHIST01"
+    version = 1
+    headerFormat = "<8sIIIII"
+    headerSize = 64
+    keySize = 256
+    keyColumns = ["DATABASE", "HOST", "PORT", "SERVICE_NAME", "SECONDARY_SITE_ID", "SECONDARY_SITE_NAME"]
+    columns = ["SECONDARY_RECONNECT_COUNT", "SECONDARY_FAILOVER_COUNT", "LAST_LOG_POSITION", "LAST_LOG_POSITION_TIME", "SHIPPED_LOG_POSITION", "SHIPPED_LOG_POSITION_TIME",
+               "SHIPPED_LOG_BUFFERS_COUNT", "SHIPPED_LOG_BUFFERS_SIZE", "SHIPPED_LOG_BUFFERS_DURATION", "SHIPPED_FULL_REPLICA_COUNT", "SHIPPED_FULL_REPLICA_SIZE",
+               "SHIPPED_DELTA_REPLICA_COUNT", "SHIPPED_DELTA_REPLICA_SIZE"]
+    recordFormat = "<qIhh" + "q" * len(columns)
+    recordSize = 8 + 4 + 2 + 2 + 8 * len(columns) # struct.calcsize(recordFormat), "<" adds no padding
+    sampleColumns = keyColumns + ["REPLICATION_STATUS"] + columns
+
+    serviceColumns = ["SECONDARY_SITE_ID", "SECONDARY_SITE_NAME", "DATABASE", "HOST", "PORT", "SERVICE_NAME", "SAMPLES", "NOT_ACTIVE_SAMPLES", "RECONNECTS", "FAILOVERS",
+                      "FULL_REPLICAS", "FULL_REPLICA_SIZE", "DELTA_REPLICAS", "DELTA_REPLICA_SIZE", "SHIPPED_LOG_SIZE", "SHIPPING_THROUGHPUT", "LOG_POSITION_LAG", "AVG_LOG_POSITION_LAG", "LOG_TIME_LAG"]
+    serviceHeaders = ["Secondary\nSite ID", "Secondary\nSite Name", "Database", "Host", "Port", "Service Name", "Samples", "Samples not\nACTIVE", "Reconnects", "Failovers",
+                      "Full\nReplicas", "Full Replica\nSize", "Delta\nReplicas", "Delta Replica\nSize", "Shipped Log\nSize", "Shipping\nThroughput (B/s)", "Max. Log\nPosition Lag", "Avg. Log\nPosition Lag", "Max. Log\nTime Lag (s)"]
+    siteColumns = ["SITE_ID", "SITE_NAME", "SERVICES", "SAMPLES", "NOT_ACTIVE_SAMPLES", "RECONNECTS", "FAILOVERS", "FULL_REPLICAS", "FULL_REPLICA_SIZE", "DELTA_REPLICAS",
+                   "DELTA_REPLICA_SIZE", "SHIPPED_LOG_SIZE", "SHIPPING_THROUGHPUT", "LOG_POSITION_LAG", "LOG_TIME_LAG"]
+    siteHeaders = ["Secondary\nSite ID", "Secondary\nSite Name", "Services", "Samples", "Samples not\nACTIVE", "Reconnects", "Failovers", "Full\nReplicas", "Full Replica\nSize",
+                   "Delta\nReplicas", "Delta Replica\nSize", "Shipped Log\nSize", "Shipping\nThroughput (B/s)", "Max. Log\nPosition Lag", "Max. Log\nTime Lag (s)"]
+    # (trend column, record column) of the counters summed over a window
+    counters = [("RECONNECTS", "SECONDARY_RECONNECT_COUNT"), ("FAILOVERS", "SECONDARY_FAILOVER_COUNT"), ("FULL_REPLICAS", "SHIPPED_FULL_REPLICA_COUNT"),
+                ("FULL_REPLICA_SIZE", "SHIPPED_FULL_REPLICA_SIZE"), ("DELTA_REPLICAS", "SHIPPED_DELTA_REPLICA_COUNT"), ("DELTA_REPLICA_SIZE", "SHIPPED_DELTA_REPLICA_SIZE"),
+                ("SHIPPED_LOG_SIZE", "SHIPPED_LOG_BUFFERS_SIZE")]
+
+    def __init__(self, path, maxBytes = 64 << 20, files = 4, keySlots = 4096):
+        self.path = path
+        self.maxBytes = maxBytes
+        self.files = max(files, 1)
+        # the key area of a new file takes half of maxBytes at most, else a small file would rotate after every sample
+        self.newKeySlots = max(min(keySlots, maxBytes / 2 / StatusHistory.keySize), 1)
+        self.keySlots = self.newKeySlots
+        self.file = None
+        self.keys = {}
+        self.size = 0
+        self.lastTime = 0
+
+    @staticmethod
+    def dataOffset(keySlots):
+        return StatusHistory.headerSize + keySlots * StatusHistory.keySize
+
+    # window like 90s, 30m, 24h or 7d in seconds, plain numbers are seconds
+    @staticmethod
+    def parseWindow(s):
+        units = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+        if s and s[-1] in units:
+            return float(s[:-1]) * units[s[-1]]
+        return float(s)
+
+    @staticmethod
+    def readHeader(data, path):
+        import struct # only needed by --sample and --trend
+        if len(data) < StatusHistory.headerSize:
+            raise ValueError("%s is not a replication history file" % path)
+        magic, version, recordSize, keySize, keySlots, used = struct.unpack_from(StatusHistory.headerFormat, data)
+        if magic != StatusHistory.magic or version != StatusHistory.version or recordSize != StatusHistory.recordSize or keySize != StatusHistory.keySize:
+            raise ValueError("%s is not a replication history file" % path)
+        return keySlots, used
+
+    @staticmethod
+    def parseKey(data):
+        values = data.rstrip("\0").split("\t")
+        for i in (2, 4): # PORT, SECONDARY_SITE_ID
+            if values[i].isdigit():
+                values[i] = int(values[i])
+        return tuple(values)
+
+    def open(self):
+        import fcntl, struct # only needed by --sample
+        self.file = os.fdopen(os.open(self.path, os.O_RDWR | os.O_CREAT, 0644), "r+b")
+        try:
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError:
+            self.close()
+            raise IOError("%s is written by another process" % self.path)
+        self.keys = {}
+        self.lastTime = 0
+        size = os.fstat(self.file.fileno()).st_size
+        if size == 0:
+            self.keySlots = self.newKeySlots
+            self.file.write(struct.pack(StatusHistory.headerFormat, StatusHistory.magic, StatusHistory.version, StatusHistory.recordSize, StatusHistory.keySize, self.keySlots, 0))
+            self.file.truncate(StatusHistory.dataOffset(self.keySlots))
+            self.file.flush()
+            self.size = StatusHistory.dataOffset(self.keySlots)
+            return
+        self.keySlots, used = StatusHistory.readHeader(self.file.read(StatusHistory.headerSize), self.path)
+        offset = StatusHistory.dataOffset(self.keySlots)
+        self.file.seek(StatusHistory.headerSize)
+        for slot in range(used):
+            self.keys[self.file.read(StatusHistory.keySize).rstrip("\0")] = slot
+        count = max(size - offset, 0) / StatusHistory.recordSize
+        self.size = offset + count * StatusHistory.recordSize
+        if self.size != size:
+            self.file.truncate(self.size) # drop a record cut short by a crash
+        if count:
+            self.file.seek(self.size - StatusHistory.recordSize)
+            self.lastTime = struct.unpack_from("<q", self.file.read(8))[0]
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def rotate(self):
+        self.close()
+        if self.files == 1:
+            os.remove(self.path)
+        for i in range(self.files - 1, 0, -1):
+            source = self.path if i == 1 else "%s.%d" % (self.path, i - 1)
+            if os.path.exists(source):
+                os.rename(source, "%s.%d" % (self.path, i))
+        self.open()
+
+    # appends one record per row (the sampleColumns of getSystemReplicationStatus rows), returns the number of records
+    def append(self, rows, sampleTime = None):
+        import struct
+        sampleTime = max(int((sampleTime or time.time()) * 1000000), self.lastTime) # keep the records ordered by time
+        samples = []
+        for row in rows:
+            key = "\t".join(unicode(row.get(c, "")).encode("utf-8") for c in StatusHistory.keyColumns)[:StatusHistory.keySize]
+            values = []
+            for c in StatusHistory.columns:
+                v = rawValue(row, c)
+                values.append(-1 if v is None else int(v))
+            samples.append((key, ServiceStatus.fromStr(row.get("REPLICATION_STATUS"), None, 0), values)) # 0: STOPPED and other unknown states
+        if not samples:
+            return 0
+
+        newKeys = set(key for key, status, values in samples if key not in self.keys)
+        size = len(samples) * StatusHistory.recordSize
+        hasRecords = self.size > StatusHistory.dataOffset(self.keySlots)
+        if hasRecords and (self.size + size > self.maxBytes or len(self.keys) + len(newKeys) > self.keySlots):
+            self.rotate()
+            newKeys = set(key for key, status, values in samples)
+        if newKeys:
+            # key slots are in use before any record refers to them, readers rely on that order
+            for key in sorted(newKeys):
+                if len(self.keys) >= self.keySlots:
+                    break
+                self.file.seek(StatusHistory.headerSize + len(self.keys) * StatusHistory.keySize)
+                self.file.write(key.ljust(StatusHistory.keySize, "\0"))
+                self.keys[key] = len(self.keys)
+            self.file.seek(struct.calcsize(StatusHistory.headerFormat) - 4)
+            self.file.write(struct.pack("<I", len(self.keys)))
+            self.file.flush()
+
+        data = []
+        for key, status, values in samples:
+            if key in self.keys: # more services than key slots in a new file are dropped
+                data.append(struct.pack(StatusHistory.recordFormat, sampleTime, self.keys[key], status, 0, *values))
+        self.file.seek(self.size)
+        self.file.write("".join(data))
+        self.file.flush()
+        self.size += len(data) * StatusHistory.recordSize
+        self.lastTime = sampleTime
+        return len(data)
+
+    # the history files, oldest first
+    def paths(self):
+        paths = ["%s.%d" % (self.path, i) for i in range(self.files - 1, 0, -1)] + [self.path]
+        return [path for path in paths if os.path.exists(path)]
+
+    # (key, record) of the samples taken from start to end (microseconds), oldest first. Each file is memory mapped,
+    # the first record of the window is found by binary search and only the key slots referred to are decoded.
+    def records(self, start, end):
+        import mmap, struct # only needed by --trend
+        recordSize = StatusHistory.recordSize
+        for path in self.paths():
+            try:
+                f = open(path, "rb")
+            except IOError: # rotated meanwhile
+                continue
+            try:
+                size = os.fstat(f.fileno()).st_size # before the header, the keys of complete records are in use by then
+                keySlots, used = StatusHistory.readHeader(f.read(StatusHistory.headerSize), path)
+                offset = StatusHistory.dataOffset(keySlots)
+                count = max(size - offset, 0) / recordSize
+                if count == 0:
+                    continue
+                data = mmap.mmap(f.fileno(), size, access = mmap.ACCESS_READ)
+                try:
+                    sampleTime = lambda i: struct.unpack_from("<q", data, offset + i * recordSize)[0]
+                    if sampleTime(0) > end or sampleTime(count - 1) < start:
+                        continue
+                    lo, hi = 0, count
+                    while lo < hi:
+                        mid = (lo + hi) / 2
+                        if sampleTime(mid) < start:
+                            lo = mid + 1
+                        else:
+                            hi = mid
+                    keys = {}
+                    for i in xrange(lo, count):
+                        record = struct.unpack_from(StatusHistory.recordFormat, data, offset + i * recordSize)
+                        if record[0] > end:
+                            break
+                        key = keys.get(record[1])
+                        if key is None:
+                            slot = StatusHistory.headerSize + record[1] * StatusHistory.keySize
+                            key = keys[record[1]] = StatusHistory.parseKey(data[slot:slot + StatusHistory.keySize])
+                        yield key, record
+                finally:
+                    data.close()
+            finally:
+                f.close()
+
+    # returns (services, sites): the trend records of every secondary service and every secondary site from start to end
+    # (seconds since the epoch). Counter increases are summed between successive samples, a counter that went down was
+    # reset and counts from 0.
+    def trends(self, start, end):
+        states = {}
+        sampleTimes = {}
+        for key, record in self.records(int(start * 1000000), int(end * 1000000)):
+            values = dict(zip(StatusHistory.columns, record[4:]))
+            state = states.get(key)
+            if state is None:
+                state = states[key] = dict.fromkeys(["SAMPLES", "NOT_ACTIVE_SAMPLES", "lagSum", "lagSamples"] + [c for c, k in StatusHistory.counters], 0)
+                state.update({"first": record[0], "LOG_POSITION_LAG": None, "LOG_TIME_LAG": None, "previous": values})
+            previous = state["previous"]
+            for column, k in StatusHistory.counters:
+                if values[k] >= 0 and previous[k] >= 0:
+                    state[column] += values[k] - previous[k] if values[k] >= previous[k] else values[k]
+            state["previous"] = values
+            state["last"] = record[0]
+            state["SAMPLES"] += 1
+            if record[2] and record[2] != ServiceStatus.Active:
+                state["NOT_ACTIVE_SAMPLES"] += 1
+            lag = ReplicationMetrics.lag(*[values[k] if values[k] >= 0 else None for k in ["LAST_LOG_POSITION", "SHIPPED_LOG_POSITION"]])
+            if lag is not None:
+                state["lagSum"] += lag
+                state["lagSamples"] += 1
+                state["LOG_POSITION_LAG"] = max(state["LOG_POSITION_LAG"], lag)
+            if values["LAST_LOG_POSITION_TIME"] > 0 and values["SHIPPED_LOG_POSITION_TIME"] > 0:
+                timeLag = round(ReplicationMetrics.lag(values["LAST_LOG_POSITION_TIME"], values["SHIPPED_LOG_POSITION_TIME"]) / 1000000.0, 6)
+                state["LOG_TIME_LAG"] = max(state["LOG_TIME_LAG"], timeLag)
+            sampleTimes.setdefault(key[4], set()).add(record[0])
+
+        services = []
+        sites = collections.OrderedDict()
+        for key in sorted(states, key = lambda k: (k[4], k[0], k[1], k[2])):
+            state = states[key]
+            record = collections.OrderedDict(zip(["SECONDARY_SITE_ID", "SECONDARY_SITE_NAME", "DATABASE", "HOST", "PORT", "SERVICE_NAME"], [key[4], key[5], key[0], key[1], key[2], key[3]]))
+            for column in StatusHistory.serviceColumns[6:]:
+                record[column] = state.get(column)
+            record["SHIPPING_THROUGHPUT"] = ReplicationMetrics.rate(state["SHIPPED_LOG_SIZE"], state["last"] - state["first"])
+            record["AVG_LOG_POSITION_LAG"] = state["lagSum"] / state["lagSamples"] if state["lagSamples"] else None
+            services.append(record)
+
+            if key[4] not in sites:
+                sites[key[4]] = collections.OrderedDict([("SITE_ID", key[4]), ("SITE_NAME", key[5]), ("SERVICES", 0), ("SAMPLES", len(sampleTimes[key[4]]))] +
+                                                        [(c, None if c in ("SHIPPING_THROUGHPUT", "LOG_POSITION_LAG", "LOG_TIME_LAG") else 0) for c in StatusHistory.siteColumns[4:]])
+            site = sites[key[4]]
+            site["SERVICES"] += 1
+            for column in StatusHistory.siteColumns[4:]:
+                if record[column] is None:
+                    continue
+                if column in ("LOG_POSITION_LAG", "LOG_TIME_LAG"):
+                    site[column] = max(site[column], record[column])
+                else:
+                    site[column] = (site[column] or 0) + record[column]
+        return services, sites.values()
+
+    def printTrends(self, services, sites, start, end, outputFormat = None):
+        if outputFormat:
+            writer = StructuredStatusWriter(outputFormat)
+            writer.writeRecords("services", "service", services)
+            writer.writeRecords("sites", "site", sites)
+            writer.close()
+            return 0
+        print "replication history of %s from %s to %s" % (self.path, formatTimestamp(start * 1000000), formatTimestamp(end * 1000000))
+        if not services:
+            print "no samples"
+            return 0
+        print
+        TableRenderer(StatusHistory.serviceColumns, StatusHistory.serviceHeaders).render(services)
         print
+        TableRenderer(StatusHistory.siteColumns, StatusHistory.siteHeaders).render(sites)
+        return 0
 
 # interface for third party software to consume this script via python
-def getLandscapeConfiguration(site):
+# Answered by the local status cache daemon (--daemon) when it is running, else fetched directly.
+# deadline: seconds the call may take, after that ([], ServiceStatus.Unknown) is returned. The *Async variants return a
+# StatusRequest instead, whose result() waits until the deadline at most.
+def getLandscapeConfiguration(site, deadline = None):
+    return getLandscapeConfigurationAsync(site, deadline).result()
+
+def getLandscapeConfigurationUpdatedVersion(site, requestSecondaryActiveStatus = True, local = False, deadline = None):
+    return getLandscapeConfigurationUpdatedVersionAsync(site, requestSecondaryActiveStatus, local, deadline).result()
+
+def getLandscapeConfigurationAsync(site, deadline = None):
+    return StatusRequest(queryLandscapeConfiguration, ("getLandscapeConfiguration", site), {}, deadline, ([], ServiceStatus.Unknown))
+
+def getLandscapeConfigurationUpdatedVersionAsync(site, requestSecondaryActiveStatus = True, local = False, deadline = None):
+    return StatusRequest(queryLandscapeConfiguration, ("getLandscapeConfigurationUpdatedVersion", site, requestSecondaryActiveStatus, local), {}, deadline, ([], ServiceStatus.Unknown))
+
+# overall ServiceStatus only, as returned by --check (ServiceStatus.Unknown after the deadline), never from the daemon
+def checkStatus(site = None, local = False, deadline = None):
+    return SystemReplicationStatus().checkStatusAsync(site, local, deadline = deadline).result()
+
+def queryLandscapeConfiguration(method, *args):
+    result = StatusCacheClient().query(method, *args)
+    if result is not None:
+        return result
     sysRepStatus = SystemReplicationStatus()
-    return sysRepStatus.getLandscapeConfiguration(site)
+    config, status = getattr(sysRepStatus, method)(*args)
+    return toDicts(config), status # plain dicts, as the daemon answers
 
 class HSRTreeNode:
     def __init__(self, id="", name="", mode=""):
@@ -388,52 +2330,115 @@ class HSRTreeNode:
         self.name = name
         self.mode = mode
         self.children = []
+        # aggregated status and mode of the replication from the parent site, None if not reported
+        self.replicationStatus = None
+        self.replicationMode = None
     def addChild(self, node):
         self.children.append(node)
 
-def addToHSRTree(tree, hsrNodes, hsrMappings):
-    for k, v in hsrMappings.items():
-        if k == tree.id:
-            for node in v:
-                tree.addChild(hsrNodes[node])
-                addToHSRTree(hsrNodes[node], hsrNodes, hsrMappings)
+# (node, depth) of the tree in the order it is printed
+def walkTree(tree):
+    stack = [(tree, 0)]
+    while stack:
+        node, depth = stack.pop()
+        yield node, depth
+        for child in reversed(node.children):
+            stack.append((child, depth + 1))
 
 def printTree(tree, depth = 0):
-    print "     |" * depth, ("---" if (depth > 0) else ""), tree.name, " (", tree.mode, ")"
-    for child in tree.children:
-        printTree(child, depth+1)
-
-def printLandscapeTree():
-    print "HANA System Replication landscape:"
-    ns = NameServerPy.TNSClient()
-    ownSiteId = ns.getDRDatacenter()
+    for node, d in walkTree(tree):
+        line = ["     |" * (depth + d), ("---" if (depth + d > 0) else ""), node.name, " (", node.mode, ")"]
+        if node.replicationStatus is not None:
+            line.extend(["status:", ServiceStatus.toStr(node.replicationStatus)])
+        print " ".join(line)
+
+def getChildNode(node, name):
+    for child in node.getNodes():
+        if child.getName() == name:
+            return child
+    return None
+
+# Builds the HSRTreeNode graph below the own site from a single getTree('/datacenters') request in time linear to
+# the number of sites and mappings. Each node is annotated with the aggregated status and mode of the replication from
+# its parent as reported by getLandscapeConfigurationUpdatedVersion. A mapping to a site that is already part of the
+# tree is not followed, these are returned as (source id, target id, reason) next to the root. The reason is "cycle"
+# if the target is an ancestor of the source (or the source itself), else "duplicate" (a second path to the target).
+def buildLandscapeTree(sysRepStatus = None):
+    sysRepStatus = sysRepStatus or SystemReplicationStatus()
+    session = sysRepStatus.session
+    ownSiteId = session.getDRDatacenter()
+
+    datacenters = getBackend().createTreeNode()
+    session.call("getTree", '/datacenters', datacenters)
 
     hsrNodes = {}
-    hsrMappings = {}
-
-    # Site names
-    names = NameServerPy.TNode()
-    ns.getTree('/datacenters/name',names)
-    for name in names.getNodes():
+    names = getChildNode(datacenters, "name")
+    for name in (names.getNodes() if names else []):
         hsrNodes[name.getName()] = HSRTreeNode(id=name.getName(), name=name.getValue())
 
-    # Replication modes
-    modes = NameServerPy.TNode()
-    ns.getTree('/datacenters/mode',modes)
-    for mode in modes.getNodes():
-        hsrNodes[mode.getName()].mode = mode.getValue()
+    modes = getChildNode(datacenters, "mode")
+    for mode in (modes.getNodes() if modes else []):
+        if mode.getName() in hsrNodes:
+            hsrNodes[mode.getName()].mode = mode.getValue()
+
+    hsrMappings = {}
+    mappings = getChildNode(datacenters, "mappings")
+    for source in (mappings.getNodes() if mappings else []):
+        hsrMappings[source.getName()] = [target.getName() for target in source.getNodes()]
 
-    # Create Mapping Tree
-    mappings = NameServerPy.TNode()
-    ns.getTree('/datacenters/mappings', mappings)
-    for source in mappings.getNodes():
-        hsrMappings[source.getName()] = []
-        for target in source.getNodes():
-            hsrMappings[source.getName()].append(target.getName())
+    edges = {}
+    config, status = sysRepStatus.getLandscapeConfigurationUpdatedVersion(None)
+    if not isinstance(status, int):
+        for id, st in status.items():
+            if "SOURCE_SITE_ID" in st:
+                edges[(str(st["SOURCE_SITE_ID"]), str(id))] = st
+
+    def getNode(id):
+        if id not in hsrNodes:
+            hsrNodes[id] = HSRTreeNode(id=id, name=id) # mapped, but without a name entry
+        return hsrNodes[id]
+
+    root = getNode(str(ownSiteId))
+    skipped = []
+    parents = {}
+    visited = set([root.id])
+    queue = collections.deque([root])
+    while queue:
+        node = queue.popleft()
+        for id in hsrMappings.get(node.id, []):
+            if id in visited:
+                ancestor = node.id
+                while ancestor is not None and ancestor != id:
+                    ancestor = parents.get(ancestor)
+                skipped.append((node.id, id, "cycle" if ancestor == id else "duplicate"))
+                continue
+            visited.add(id)
+            child = getNode(id)
+            parents[id] = node.id
+            edge = edges.get((node.id, id))
+            if edge is not None:
+                child.replicationStatus = edge["REPLICATION_STATUS"]
+                child.replicationMode = edge["REPLICATION_MODE"]
+            node.addChild(child)
+            queue.append(child)
+    return root, skipped
+
+def printLandscapeTree(outputFormat = None):
+    if outputFormat:
+        writer = StructuredStatusWriter(outputFormat)
+        writer.writeTree(*buildLandscapeTree())
+        writer.close()
+        return
 
-    hsrTree = hsrNodes[str(ownSiteId)]
-    addToHSRTree(hsrTree, hsrNodes, hsrMappings)
-    printTree(hsrTree)
+    print "HANA System Replication landscape:"
+    hsrTree, skipped = buildLandscapeTree()
+    with profilePhase("render"):
+        printTree(hsrTree)
+        for source, target, reason in skipped:
+            if reason == "cycle":
+                print "mapping %s -> %s not followed, it leads back to site %s (a cycle)" % (source, target, target)
+            else:
+                print "mapping %s -> %s not followed, site %s is already part of the landscape" % (source, target, target)
 
 def main(argv):
     longFormat = False
@@ -441,14 +2446,36 @@ def main(argv):
     site = None
     sapcontrol = False
     requestSecondaryActiveStatus = True
+    watchInterval = None
+    daemonTtl = None
+    streaming = False
+    outputFormat = None
+    metrics = None
+    socketPath = None
+    exporterAddress = None
+    cacheInterval = 15.0
+    systemsFile = None
+    timeout = 30.0
+    parallel = 8
+    landscapeTree = False
+    filters = {}
+    columns = None
+    historyPath = None
+    historyBytes = 64 << 20
+    historyFiles = 4
+    sampleInterval = None
+    trendWindow = None
+    trendEnd = None
+    profile = False
+    check = False
 
     if os.getuid() == 0:
         print "It is prohibited to execute systemReplicationStatus.py as root user"
         return 1
 
-    syntaxHelp = 'systemReplicationStatus.py [-h|--help] [-a|--all] [-l|--localhost] [-s|--site=<site name>] [-t|--printLandscapeTree] [--omitSecondaryActiveStatus] [--sapcontrol=1]'
+    syntaxHelp = 'systemReplicationStatus.py [-h|--help] [-a|--all] [-l|--localhost] [-s|--site=<site name>] [--host=<host>] [--database=<database>] [--service=<service name>] [--columns=<column>,...] [-t|--printLandscapeTree] [--omitSecondaryActiveStatus] [--sapcontrol=1] [--format=json|ndjson|csv] [--metrics] [--stream] [--watch=<seconds>] [--daemon=<ttl seconds>] [--socket=<path>] [--exporter=[<address>:]<port>] [--cacheInterval=<seconds>] [--systems=<file> [--timeout=<seconds>] [--parallel=<n>]] [--history=<file> [--historySize=<MB>] [--historyFiles=<n>] --sample=<seconds>|--trend=<window>[s|m|h|d] [--until=<YYYY-mm-dd HH:MM:SS>]] [--check] [--profile]'
     try:
-        opts,_ = getopt.getopt(argv, "hals:t",["help", "all", "localhost", "site=", "printLandscapeTree", "sapcontrol=", "omitSecondaryActiveStatus"])
+        opts,_ = getopt.getopt(argv, "hals:t",["help", "all", "localhost", "site=", "printLandscapeTree", "sapcontrol=", "omitSecondaryActiveStatus", "format=", "metrics", "stream", "watch=", "daemon=", "socket=", "exporter=", "cacheInterval=", "systems=", "timeout=", "parallel=", "host=", "database=", "service=", "columns=", "history=", "historySize=", "historyFiles=", "sample=", "trend=", "until=", "check", "profile"])
     except getopt.GetoptError:
         print syntaxHelp
         return 2
@@ -465,20 +2492,145 @@ def main(argv):
             site = arg
 
         if opt in ("-t", "--printLandscapeTree"):
-            printLandscapeTree()
-            return 0
+            landscapeTree = True
 
         if opt in ("--sapcontrol"):
             if arg == "1" or arg == 1:
                 sapcontrol = True
         if opt in ("--omitSecondaryActiveStatus"):
             requestSecondaryActiveStatus = False
+        if opt == "--watch":
+            try:
+                watchInterval = float(arg)
+            except ValueError:
+                print syntaxHelp
+                return 2
+        if opt == "--daemon":
+            try:
+                daemonTtl = float(arg)
+            except ValueError:
+                print syntaxHelp
+                return 2
+        if opt == "--socket":
+            socketPath = arg
+        if opt == "--exporter":
+            address, _, port = arg.rpartition(":")
+            if not port.isdigit():
+                print syntaxHelp
+                return 2
+            exporterAddress = (address or "127.0.0.1", int(port))
+        if opt == "--cacheInterval":
+            try:
+                cacheInterval = float(arg)
+            except ValueError:
+                print syntaxHelp
+                return 2
+        if opt == "--systems":
+            systemsFile = arg
+        if opt in ("--timeout", "--parallel"):
+            try:
+                if opt == "--timeout":
+                    timeout = float(arg)
+                else:
+                    parallel = max(int(arg), 1)
+            except ValueError:
+                print syntaxHelp
+                return 2
+        if opt == "--stream":
+            streaming = True
+        if opt == "--history":
+            historyPath = arg
+        if opt == "--profile":
+            profile = True
+        if opt == "--check":
+            check = True
+        if opt in ("--historySize", "--historyFiles", "--sample", "--trend", "--until"):
+            try:
+                if opt == "--historySize":
+                    historyBytes = int(float(arg) * (1 << 20))
+                elif opt == "--historyFiles":
+                    historyFiles = max(int(arg), 1)
+                elif opt == "--sample":
+                    sampleInterval = float(arg)
+                elif opt == "--trend":
+                    trendWindow = StatusHistory.parseWindow(arg)
+                else:
+                    trendEnd = time.mktime(datetime.datetime.strptime(arg, '%Y-%m-%d %H:%M:%S').timetuple())
+            except ValueError:
+                print syntaxHelp
+                return 2
+        if opt in ("--host", "--database", "--service"):
+            filters[opt[2:]] = arg
+        if opt == "--columns":
+            columns = [c.strip().upper() for c in arg.split(",") if c.strip()]
+        if opt == "--metrics":
+            metrics = ReplicationMetrics()
+        if opt == "--format":
+            if arg not in StructuredStatusWriter.formats:
+                print syntaxHelp
+                return 2
+            outputFormat = arg
+
+    if profile:
+        setProfiler(Profiler()) # reported on stderr when the script exits
+
+    if systemsFile is not None:
+        try:
+            systems = MultiSystemCollector.readSystems(systemsFile)
+        except (IOError, ValueError), exc:
+            print "cannot read systems file:", exc
+            return 2
+        return MultiSystemCollector(systems, timeout, parallel).collectAndPrint(outputFormat)
+
+    if (sampleInterval is not None or trendWindow is not None) and historyPath is None:
+        print syntaxHelp
+        return 2
+    history = StatusHistory(historyPath, historyBytes, historyFiles)
+
+    if trendWindow is not None:
+        end = trendEnd or time.time()
+        try:
+            services, sites = history.trends(end - trendWindow, end)
+        except (IOError, ValueError), exc:
+            print "cannot read replication history:", exc
+            return 1
+        return history.printTrends(services, sites, end - trendWindow, end, outputFormat)
+
+    with profilePhase("init"):
+        getBackend() # initialize the nameserver library here, so a missing HANA installation is not reported as a missing replication
+
+    if landscapeTree:
+        printLandscapeTree(outputFormat)
+        return 0
+
+    if exporterAddress is not None:
+        return MetricsExporter(exporterAddress[0], exporterAddress[1], cacheInterval).serve()
+
+    if daemonTtl is not None:
+        return StatusCacheDaemon(socketPath, daemonTtl).serve()
 
     sysRepStatus = SystemReplicationStatus()
-    rc = sysRepStatus.getStatusAndPrint(longFormat, site, sapcontrol, requestSecondaryActiveStatus, local)
+    if check:
+        rc = sysRepStatus.checkStatus(site, local, **filters)
+        print 'overall system replication status:', ServiceStatus.toStr(rc)
+        return rc
+
+    if sampleInterval is not None:
+        try:
+            return sysRepStatus.sampleHistory(history, sampleInterval, site, requestSecondaryActiveStatus, local, filters = filters)
+        except (IOError, OSError, ValueError), exc:
+            print "cannot write replication history:", exc
+            return 1
+
+    if watchInterval is not None:
+        return sysRepStatus.watchStatus(watchInterval, longFormat, site, sapcontrol, requestSecondaryActiveStatus, local, metrics = metrics, filters = filters, columns = columns)
+
+    rc = sysRepStatus.getStatusAndPrint(longFormat, site, sapcontrol, requestSecondaryActiveStatus, local, streaming, outputFormat, metrics, filters, columns)
 
     return rc
 
 if __name__ == "__main__":
     exitCode = main(sys.argv[1:])
+    if profiler is not None:
+        profiler.report()
     sys.exit(exitCode)
@@ -0,0 +1,182 @@
+import os, sys, getopt, json, time, resource, subprocess
+import systemReplicationStatus
+import systemReplicationStatusFakeBackend
+
+# Measures systemReplicationStatus against synthetic landscapes (systemReplicationStatusFakeBackend.py), no HANA
+# installation needed. Every landscape size and output format runs in its own process so the peak memory of one
+# case does not hide the next one. Reported per case: wall time of getStatusAndPrint (best and median of the
+# repetitions), nameserver calls per run, configuration layers opened per run and the time spent loading them,
+# peak RSS and bytes written.
+# --startup instead compares the cost of a fresh interpreter for import, --help and a full status run.
+
+syntaxHelp = """usage: python systemReplicationStatusBenchmark.py [options]
+    --tenants=<n,n,...>     tenant databases per landscape size (default 10,100,1000)
+    --services=<n>          services per tenant (default 3)
+    --hosts=<n>             hosts per site (default 4)
+    --targets=<n>           secondaries of the primary site (default 1)
+    --tiers=<n>             sites per replication chain including the primary (default 2)
+    --unhealthy=<fraction>  fraction of services that are not ACTIVE (default 0.01)
+    --latency=<ms>          latency added to every nameserver call (default 0)
+    --repeat=<n>            runs per case (default 5)
+    --formats=<f,f,...>     any of %s (default all)
+    --json                  print one json object per case instead of a table
+    --startup               measure import, --help and a full run (first --tenants size) in fresh interpreters"""
+
+formats = ["table", "long", "stream", "sapcontrol", "metrics", "json", "ndjson", "csv"]
+
+# counts the bytes written instead of keeping them
+class NullStream(object):
+    def __init__(self):
+        self.size = 0
+
+    def write(self, s):
+        self.size += len(s)
+
+    def flush(self):
+        pass
+
+def getPeakRss():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024 # kilobytes on Linux
+
+def runOnce(sysRepStatus, format):
+    if format in ("json", "ndjson", "csv"):
+        return sysRepStatus.getStatusAndPrint(False, None, False, outputFormat = format)
+    return sysRepStatus.getStatusAndPrint(format == "long", None, format == "sapcontrol", streaming = format == "stream",
+                                          metrics = systemReplicationStatus.ReplicationMetrics() if format == "metrics" else None)
+
+def runCase(tenants, format, options):
+    landscape = systemReplicationStatusFakeBackend.SyntheticLandscape(tenants, options["services"], options["hosts"], options["targets"], options["tiers"], options["unhealthy"])
+    backend = systemReplicationStatusFakeBackend.FakeBackend(landscape, latency = options["latency"] / 1000.0)
+    systemReplicationStatus.setBackend(backend)
+
+    rssBefore = getPeakRss()
+    times = []
+    configLoadTimes = []
+    stdout = sys.stdout
+    for i in range(options["repeat"]):
+        backend.reset()
+        sysRepStatus = systemReplicationStatus.SystemReplicationStatus()
+        sys.stdout = NullStream()
+        try:
+            start = time.time()
+            rc = runOnce(sysRepStatus, format)
+            times.append(time.time() - start)
+            configLoadTimes.append(sysRepStatus.session.configuration.loadTime)
+            size = sys.stdout.size
+        finally:
+            sys.stdout = stdout
+    times.sort()
+    configLoadTimes.sort()
+
+    result = {"tenants": tenants, "rows": len(landscape), "format": format, "rc": rc,
+              "bestMs": times[0] * 1000, "medianMs": times[len(times) / 2] * 1000,
+              "nsCalls": backend.callCount(), "configsOpened": backend.configurationsOpened,
+              "configLoadMs": configLoadTimes[len(configLoadTimes) / 2] * 1000,
+              "peakRss": getPeakRss(), "rssGrowth": getPeakRss() - rssBefore, "outputBytes": size}
+    return result
+
+# wall time of fresh interpreters, "interpreter" is the bare python startup the other cases include
+def runStartup(tenants, repeat):
+    directory = os.path.dirname(os.path.abspath(__file__))
+    fullRun = ("import systemReplicationStatus, systemReplicationStatusFakeBackend as fake\n"
+               "systemReplicationStatus.setBackend(fake.FakeBackend(fake.SyntheticLandscape(%d)))\n"
+               "systemReplicationStatus.SystemReplicationStatus().getStatusAndPrint(False, None, False)" % tenants)
+    cases = [("interpreter", ["-c", "pass"]),
+             ("import", ["-c", "import systemReplicationStatus"]),
+             ("help", [os.path.join(directory, "systemReplicationStatus.py"), "--help"]),
+             ("run", ["-c", fullRun])]
+    results = []
+    devnull = open(os.devnull, "w")
+    for name, args in cases:
+        times = []
+        for i in range(repeat):
+            start = time.time()
+            subprocess.call([sys.executable] + args, cwd = directory, stdout = devnull) # the exit code of --help is not of interest
+            times.append(time.time() - start)
+        times.sort()
+        results.append({"case": name, "tenants": tenants if name == "run" else "-", "bestMs": times[0] * 1000, "medianMs": times[len(times) / 2] * 1000})
+    for result in results:
+        result["overInterpreterMs"] = result["bestMs"] - results[0]["bestMs"]
+    return results
+
+def printResults(results, columns = ["tenants", "rows", "format", "bestMs", "medianMs", "nsCalls", "configsOpened", "configLoadMs", "peakRss", "rssGrowth", "outputBytes"]):
+    lines = [columns]
+    for result in results:
+        line = []
+        for c in columns:
+            v = result[c]
+            if c.endswith("Ms"):
+                v = "%.1f" % v if v >= 0.1 else "%.3f" % v
+            elif c.startswith("peakRss") or c == "rssGrowth":
+                v = "%.1fM" % (v / 1024.0 / 1024.0)
+            line.append(str(v))
+        lines.append(line)
+    widths = [max(len(line[i]) for line in lines) for i in range(len(columns))]
+    for line in lines:
+        print " | ".join(v.rjust(w) for v, w in zip(line, widths))
+
+def main(argv):
+    options = {"services": 3, "hosts": 4, "targets": 1, "tiers": 2, "unhealthy": 0.01, "latency": 0.0, "repeat": 5}
+    sizes = [10, 100, 1000]
+    selected = formats
+    asJson = False
+    startup = False
+    case = None
+
+    try:
+        opts, args = getopt.getopt(argv, "h", ["help", "tenants=", "services=", "hosts=", "targets=", "tiers=", "unhealthy=", "latency=", "repeat=", "formats=", "json", "startup", "case="])
+        for opt, arg in opts:
+            if opt in ("-h", "--help"):
+                print syntaxHelp % ",".join(formats)
+                return 0
+            elif opt == "--tenants":
+                sizes = [int(x) for x in arg.split(",")]
+            elif opt == "--formats":
+                selected = arg.split(",")
+                if [x for x in selected if x not in formats]:
+                    raise ValueError(arg)
+            elif opt == "--json":
+                asJson = True
+            elif opt == "--startup":
+                startup = True
+            elif opt == "--case":
+                case = arg
+            elif opt in ("--unhealthy", "--latency"):
+                options[opt[2:]] = float(arg)
+            else:
+                options[opt[2:]] = int(arg)
+    except (getopt.GetoptError, ValueError):
+        print syntaxHelp % ",".join(formats)
+        return 2
+
+    # child process: run one case and hand the result back as json
+    if case is not None:
+        tenants, format = case.split(":")
+        print json.dumps(runCase(int(tenants), format, options))
+        return 0
+
+    if startup:
+        results = runStartup(sizes[0], options["repeat"])
+        if asJson:
+            for result in results:
+                print json.dumps(result)
+        else:
+            printResults(results, ["case", "tenants", "bestMs", "medianMs", "overInterpreterMs"])
+        return 0
+
+    passOn = ["--%s=%s" % (k, v) for k, v in options.items()]
+    results = []
+    for tenants in sizes:
+        for format in selected:
+            output = subprocess.check_output([sys.executable, os.path.abspath(__file__), "--case=%d:%s" % (tenants, format)] + passOn)
+            result = json.loads(output.splitlines()[-1])
+            if asJson:
+                print json.dumps(result)
+                sys.stdout.flush()
+            results.append(result)
+    if not asJson:
+        printResults(results)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
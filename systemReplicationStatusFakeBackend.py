@@ -0,0 +1,240 @@
+import time, random, threading
+
+# In-memory replacement for NameServerPy/ConfigMgrPy, installed with systemReplicationStatus.setBackend.
+# Serves a synthetic landscape: a primary site with one or more chains of secondary tiers, a system database
+# and any number of tenants per site, each with a set of services spread over the hosts of the site.
+# Every nameserver call can be delayed by a fixed latency and is counted per method, the local nameserver can be made
+# to hang while the master nameserver still answers.
+
+SERVICES = ["indexserver", "xsengine", "scriptserver", "docstore", "dpserver", "diserver", "webdispatcher", "compileserver"]
+
+COLUMNS = ["HOST", "PORT", "SERVICE_NAME", "VOLUME_ID", "SITE_ID", "SITE_NAME", "SECONDARY_HOST", "SECONDARY_PORT", "SECONDARY_SITE_ID", "SECONDARY_SITE_NAME", "SECONDARY_ACTIVE_STATUS", "SECONDARY_CONNECT_TIME", "SECONDARY_RECONNECT_COUNT", "SECONDARY_FAILOVER_COUNT", "REPLICATION_MODE", "REPLICATION_STATUS", "REPLICATION_STATUS_DETAILS", "LAST_LOG_POSITION", "LAST_LOG_POSITION_TIME", "LAST_SAVEPOINT_VERSION", "LAST_SAVEPOINT_LOG_POSITION", "LAST_SAVEPOINT_START_TIME", "SHIPPED_LOG_POSITION", "SHIPPED_LOG_POSITION_TIME", "SHIPPED_LOG_BUFFERS_COUNT", "SHIPPED_LOG_BUFFERS_SIZE", "SHIPPED_LOG_BUFFERS_DURATION", "SHIPPED_SAVEPOINT_VERSION", "SHIPPED_SAVEPOINT_LOG_POSITION", "SHIPPED_SAVEPOINT_START_TIME", "SHIPPED_FULL_REPLICA_COUNT", "SHIPPED_FULL_REPLICA_SIZE", "SHIPPED_FULL_REPLICA_DURATION", "SHIPPED_LAST_FULL_REPLICA_SIZE", "SHIPPED_LAST_FULL_REPLICA_START_TIME", "SHIPPED_LAST_FULL_REPLICA_END_TIME", "SHIPPED_DELTA_REPLICA_COUNT", "SHIPPED_DELTA_REPLICA_SIZE", "SHIPPED_DELTA_REPLICA_DURATION", "SHIPPED_LAST_DELTA_REPLICA_SIZE", "SHIPPED_LAST_DELTA_REPLICA_START_TIME", "SHIPPED_LAST_DELTA_REPLICA_END_TIME", "RESET_COUNT", "LAST_RESET_TIME", "CREATION_TIME", "DATABASE"]
+
+class SyntheticLandscape(object):
+    # tenants: tenant databases besides SYSTEMDB, services: services per tenant (indexserver first)
+    # targets: secondaries of the primary site, tiers: sites per replication chain including the primary
+    # unhealthy: fraction of services that are not ACTIVE, standby: fraction of standby services (VOLUME_ID 0)
+    def __init__(self, tenants = 10, services = 3, hosts = 2, targets = 1, tiers = 2, unhealthy = 0.0, standby = 0.0, seed = 0):
+        self.tenants = tenants
+        self.services = services
+        self.hosts = hosts
+        self.unhealthy = unhealthy
+        self.standby = standby
+        self.seed = seed
+        self.sites = {1: ("SITE1", "PRIMARY")}
+        self.mappings = {}
+        for target in range(targets):
+            source = 1
+            for tier in range(1, tiers):
+                siteId = len(self.sites) + 1
+                self.sites[siteId] = ("SITE%d" % siteId, "SYNC" if tier == 1 else "ASYNC")
+                self.mappings.setdefault(source, []).append(siteId)
+                source = siteId
+        self.poll = 0
+        self.__services = self.createServices()
+
+    def createServices(self):
+        rand = random.Random(self.seed)
+        services = []
+        for t in range(self.tenants + 1):
+            database = "SYSTEMDB" if t == 0 else "T%05d" % t
+            names = ["nameserver"] if t == 0 else (SERVICES * (self.services / len(SERVICES) + 1))[:self.services]
+            for n, name in enumerate(names):
+                status = "ACTIVE"
+                if rand.random() < self.unhealthy:
+                    status = rand.choice(["SYNCING", "INITIALIZING", "ERROR", "UNKNOWN"])
+                volume = 0 if t > 0 and rand.random() < self.standby else len(services) + 1
+                services.append((database, "host%03d" % (len(services) % self.hosts), 30001 + 40 * t + n, name, volume, status))
+        return services
+
+    def __len__(self):
+        return len(self.__services) * sum(len(targets) for targets in self.mappings.values())
+
+    def getRows(self, requestSecondaryActiveStatus = True, host = ""):
+        self.poll += 1
+        now = 1600000000000000 + self.poll * 1000000
+        rows = []
+        for source, targets in sorted(self.mappings.items()):
+            sourceName = self.sites[source][0]
+            for target in targets:
+                targetName, mode = self.sites[target]
+                for database, serviceHost, port, name, volume, status in self.__services:
+                    if host and serviceHost != host:
+                        continue
+                    position = (volume + 1) * 1000000 + self.poll * 4096
+                    row = dict.fromkeys(COLUMNS, 0)
+                    row.update({"DATABASE": database, "HOST": "%s-%d" % (serviceHost, source), "PORT": port, "SERVICE_NAME": name, "VOLUME_ID": volume,
+                                "SITE_ID": source, "SITE_NAME": sourceName, "SECONDARY_HOST": "%s-%d" % (serviceHost, target), "SECONDARY_PORT": port,
+                                "SECONDARY_SITE_ID": target, "SECONDARY_SITE_NAME": targetName,
+                                "SECONDARY_ACTIVE_STATUS": ("YES" if status == "ACTIVE" else "NO") if requestSecondaryActiveStatus else "UNKNOWN",
+                                "SECONDARY_CONNECT_TIME": now - 3600000000, "REPLICATION_MODE": mode, "REPLICATION_STATUS": status,
+                                "REPLICATION_STATUS_DETAILS": "" if status == "ACTIVE" else "Connection refused",
+                                "LAST_LOG_POSITION": position, "LAST_LOG_POSITION_TIME": now, "LAST_SAVEPOINT_VERSION": self.poll,
+                                "LAST_SAVEPOINT_LOG_POSITION": position - 8192, "LAST_SAVEPOINT_START_TIME": now - 300000000,
+                                "SHIPPED_LOG_POSITION": position - 64 * (volume % 3), "SHIPPED_LOG_POSITION_TIME": now - 1000 * (volume % 3),
+                                "SHIPPED_LOG_BUFFERS_COUNT": self.poll * 10, "SHIPPED_LOG_BUFFERS_SIZE": self.poll * 40960, "SHIPPED_LOG_BUFFERS_DURATION": self.poll * 2000,
+                                "SHIPPED_SAVEPOINT_VERSION": self.poll, "SHIPPED_SAVEPOINT_LOG_POSITION": position - 8192, "SHIPPED_SAVEPOINT_START_TIME": now - 300000000,
+                                "SHIPPED_FULL_REPLICA_COUNT": 1, "SHIPPED_FULL_REPLICA_SIZE": 1 << 30, "SHIPPED_FULL_REPLICA_DURATION": 60000000,
+                                "SHIPPED_LAST_FULL_REPLICA_SIZE": 1 << 30, "SHIPPED_LAST_FULL_REPLICA_START_TIME": now - 86400000000,
+                                "SHIPPED_LAST_FULL_REPLICA_END_TIME": now - 86340000000, "CREATION_TIME": now - 86400000000})
+                    rows.append(row)
+        return rows
+
+class FakeTreeNode(object):
+    def __init__(self, name = "", value = ""):
+        self.name = name
+        self.value = value
+        self.nodes = []
+
+    def getName(self):
+        return self.name
+
+    def getValue(self):
+        return self.value
+
+    def getNodes(self):
+        return self.nodes
+
+    def getNode(self, name):
+        for node in self.nodes:
+            if node.name == name:
+                return node
+        return None
+
+    def addNode(self, name, value = ""):
+        node = FakeTreeNode(name, value)
+        self.nodes.append(node)
+        return node
+
+class FakeTNSClient(object):
+    def __init__(self, backend):
+        self.backend = backend
+        self.master = False
+
+    def __call(self, method):
+        self.backend.count(method)
+        if self.backend.latency:
+            time.sleep(self.backend.latency)
+        if self.backend.localHang and not self.master:
+            time.sleep(self.backend.localHang)
+        if self.backend.down and method == "storeTrees":
+            raise RuntimeError("nameserver not reachable")
+
+    def disableNSLibraryLoad(self):
+        pass
+
+    def setNoRetries(self):
+        pass
+
+    def useMasterNameServer(self, useMaster):
+        self.master = useMaster
+
+    def storeTrees(self, trees):
+        self.__call("storeTrees")
+
+    def getDRMode(self):
+        self.__call("getDRMode")
+        return self.backend.landscape.sites[self.backend.siteId][1].lower()
+
+    def getDRDatacenter(self):
+        self.__call("getDRDatacenter")
+        return self.backend.siteId
+
+    def drGetSourceSystem(self):
+        self.__call("drGetSourceSystem")
+        for source, targets in self.backend.landscape.mappings.items():
+            if self.backend.siteId in targets:
+                return source
+        return 0
+
+    def getServiceHost(self):
+        self.__call("getServiceHost")
+        return "host000-%d" % self.backend.siteId
+
+    def getSystemReplicationInfo(self):
+        self.__call("getSystemReplicationInfo")
+        landscape = self.backend.landscape
+        return {"mode": landscape.sites[self.backend.siteId][1].lower(), "numConsumers": len(landscape.mappings.get(self.backend.siteId, []))}
+
+    def getSystemReplicationStatus(self, requestSecondaryActiveStatus, host):
+        self.__call("getSystemReplicationStatus")
+        if host:
+            host = host.rsplit("-", 1)[0]
+        return self.backend.landscape.getRows(requestSecondaryActiveStatus, host)
+
+    # /datacenters with the name, mode and mappings subtrees, or one of the subtrees
+    def getTree(self, path, node):
+        self.__call("getTree")
+        landscape = self.backend.landscape
+        subtrees = ["name", "mode", "mappings"]
+        parts = path.strip("/").split("/")
+        if len(parts) > 1:
+            subtrees = parts[1:2]
+        for subtree in subtrees:
+            parent = node if len(parts) > 1 else node.addNode(subtree)
+            if subtree == "mappings":
+                for source, targets in sorted(landscape.mappings.items()):
+                    child = parent.addNode(str(source))
+                    for target in targets:
+                        child.addNode(str(target))
+            else:
+                for siteId, (name, mode) in sorted(landscape.sites.items()):
+                    parent.addNode(str(siteId), name if subtree == "name" else mode.lower())
+
+class FakeConfiguration(object):
+    def __init__(self, backend, fileName, layer):
+        self.backend = backend
+        self.fileName = fileName
+        self.layer = layer
+
+    def getStringValue(self, section, key):
+        return self.backend.configuration.get((self.fileName, section, key), "")
+
+class FakeBackend(object):
+    layers = ("CUSTOMER", "READONLY")
+
+    # siteId: the site the script runs on, latency: seconds added to every nameserver call, down: nameserver not reachable,
+    # localHang: seconds added to every call not made through the master nameserver
+    def __init__(self, landscape = None, siteId = 1, latency = 0.0, down = False, localHang = 0.0):
+        self.landscape = landscape if landscape is not None else SyntheticLandscape()
+        self.siteId = siteId
+        self.latency = latency
+        self.down = down
+        self.localHang = localHang
+        self.calls = {}
+        self.configurationsOpened = 0
+        self.configurationVersion = 0
+        self.lock = threading.Lock()
+        sourceSiteId = dict((t, s) for s, targets in self.landscape.mappings.items() for t in targets).get(siteId, 0)
+        self.configuration = {("global.ini", "multidb", "mode"): "multidb",
+                              ("global.ini", "system_replication", "site_name"): self.landscape.sites[siteId][0],
+                              ("global.ini", "system_replication_site_masters", str(sourceSiteId)): "host000-%d:30001" % sourceSiteId}
+
+    def count(self, method):
+        with self.lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+
+    def callCount(self):
+        return sum(self.calls.values())
+
+    def reset(self):
+        self.calls = {}
+        self.configurationsOpened = 0
+
+    def createTNSClient(self):
+        return FakeTNSClient(self)
+
+    def createTreeNode(self):
+        return FakeTreeNode()
+
+    def getConfiguration(self, fileName, layer):
+        self.configurationsOpened += 1
+        return FakeConfiguration(self, fileName, layer)
+
+    def getConfigurationStamp(self, fileName, layer):
+        return self.configurationVersion
+
+    # changes a value as if global.ini had been edited
+    def setConfiguration(self, fileName, section, key, value):
+        self.configuration[(fileName, section, key)] = value
+        self.configurationVersion += 1
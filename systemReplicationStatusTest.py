@@ -0,0 +1,577 @@
+import os, sys, copy, random, datetime, time, tempfile, types, unittest, StringIO, collections, csv, json
+import systemReplicationStatus
+import systemReplicationStatusFakeBackend as fake
+from systemReplicationStatus import ServiceStatus
+
+# Runs against the fake backend (systemReplicationStatusFakeBackend.py), no HANA installation needed:
+#     python systemReplicationStatusTest.py
+
+STATUSES = ["ACTIVE", "ACTIVE", "ACTIVE", "SYNCING", "INITIALIZING", "ERROR", "UNKNOWN", "STOPPED", "TENANTCOPY", "SUSPENDED", ""]
+SECONDARY_HOSTS = ["host000", "host001", "NOT MAPPED", "not_mapped", "Not Mapped"]
+SITE_NAMES = {2: ["SITE2", "site2"], 3: ["SITE3", "Site3"]}
+
+# previous getLandscapeConfiguration/getLandscapeConfigurationUpdatedVersion working on plain dicts, both public
+# functions must keep returning exactly what these return
+def formatRow(row):
+    for k, v in row.items():
+        if k.endswith("_TIME"):
+            if v > 0:
+                row[k] = datetime.datetime.fromtimestamp(int(v)/1000.0/1000.0).strftime('%Y-%m-%d %H:%M:%S.%f')
+            else:
+                row[k] = "-"
+
+def selectRows(config, site):
+    config = [row for row in config if not row['VOLUME_ID'] == 0]
+    config.sort(lambda a, b:cmp(a['SITE_ID'], b['SITE_ID']))
+    if site != None:
+        config2 = []
+        for row in config:
+            if row["SECONDARY_HOST"].lower() in ["not mapped", "not_mapped"]:
+                continue
+            if row["SECONDARY_SITE_NAME"].lower() == site.lower():
+                config2.append(row)
+        config = config2
+    return config
+
+def referenceLandscapeConfiguration(config, site):
+    status = {}
+    config = selectRows(config, site)
+    for row in config:
+        if row['REPLICATION_STATUS'] == "STOPPED" or row['REPLICATION_STATUS'] == "TENANTCOPY":
+            continue
+        if row["SECONDARY_HOST"].lower() in ["not mapped", "not_mapped"]:
+            status['NOT MAPPED']= ServiceStatus.Error
+            continue
+        if not status.has_key(row["SECONDARY_SITE_NAME"]):
+            status[row["SECONDARY_SITE_NAME"]] = ServiceStatus.Active
+        service_status = ServiceStatus.fromStr(row['REPLICATION_STATUS'], row['SECONDARY_ACTIVE_STATUS'])
+        if service_status < status[row["SECONDARY_SITE_NAME"]]:
+            status[row["SECONDARY_SITE_NAME"]] = service_status
+        formatRow(row)
+    return (config, status)
+
+def referenceLandscapeConfigurationUpdatedVersion(config, site):
+    status = {}
+    config = selectRows(config, site)
+    for row in config:
+        if row['REPLICATION_STATUS'] == "STOPPED" or row['REPLICATION_STATUS'] == "TENANTCOPY":
+            continue
+        if row["SECONDARY_HOST"].lower() in ["not mapped", "not_mapped"]:
+            status['NOT MAPPED']= {"SECONDARY_SITE_NAME" : "ERROR",
+             "REPLICATION_MODE" : "ERROR",
+             "REPLICATION_STATUS" : ServiceStatus.Error}
+            continue
+        if not status.has_key(row["SECONDARY_SITE_ID"]):
+            status[row["SECONDARY_SITE_ID"]] = {"SECONDARY_SITE_NAME" : row["SECONDARY_SITE_NAME"],
+                 "REPLICATION_MODE" : row["REPLICATION_MODE"],
+                 "SOURCE_SITE_ID" : row["SITE_ID"],
+                 "REPLICATION_STATUS" : ServiceStatus.Active}
+        service_status = ServiceStatus.fromStr(row['REPLICATION_STATUS'], row['SECONDARY_ACTIVE_STATUS'])
+        if service_status < status[row["SECONDARY_SITE_ID"]]["REPLICATION_STATUS"]:
+            status[row["SECONDARY_SITE_ID"]]["REPLICATION_STATUS"] = service_status
+        formatRow(row)
+    return (config, status)
+
+# previous printDictList and sapcontrol service lines, the table and sapcontrol output must stay byte-identical
+def referencePrintDictList(table, columns, headers):
+    l={} # max. column length
+    hr=1 # number of header rows
+    for c,h in zip(columns,headers):
+        hh=h.split('\n')
+        if len(hh)>hr: hr=len(hh)
+        for hhh in hh:
+            if c not in l:      l[c]=len(hhh)
+            elif len(hhh)>l[c]: l[c]=len(hhh)
+    for row in table:
+        for c in columns:
+            if c not in row:                        l_c=1
+            elif type(row[c]) in types.StringTypes: l_c=len(    row[c] )
+            else:                                   l_c=len(str(row[c]))
+            if l_c>l[c]: l[c]=l_c
+    print '|',
+    for i in range(hr):
+        for c,h in zip(columns,headers):
+            hh=h.split('\n')
+            if len(hh)>i: h=hh[i]
+            else:         h=''
+            print h.ljust(l[c])+' |',
+        print '\n|',
+    for c in columns:
+        print '-'*l[c]+' |',
+    for row in table:
+        print '\n|',
+        for c in columns:
+            if c not in row:                        print     '?'    .ljust(l[c])+' |',
+            elif type(row[c]) in types.StringTypes: print     row[c] .ljust(l[c])+' |',
+            else:                                   print str(row[c]).rjust(l[c])+' |',
+    print
+
+def referencePrintSapcontrol(config):
+    for l in config:
+        for k, v in l.items():
+            print "service/" + l["HOST"] + "/" + str(l["PORT"]) + "/" + k + "=" + str(v)
+
+# a primary with two secondaries whose rows are drawn at random, including standby services, unmapped secondary
+# hosts, site names in different case, stopped and unknown statuses and unset timestamps
+class RandomLandscape(fake.SyntheticLandscape):
+    def __init__(self, seed):
+        fake.SyntheticLandscape.__init__(self, targets = 2, tiers = 2)
+        rand = random.Random(seed)
+        self.rows = []
+        for i in range(rand.randint(0, 40)):
+            status = rand.choice(STATUSES)
+            secondary = rand.choice([2, 3])
+            row = dict.fromkeys(fake.COLUMNS, 0)
+            row.update({"DATABASE": rand.choice(["SYSTEMDB", "T00001"]), "HOST": "host%03d-1" % rand.randint(0, 2), "PORT": 30001 + i,
+                        "SERVICE_NAME": rand.choice(fake.SERVICES), "VOLUME_ID": rand.choice([0, i + 1, i + 1]), "SITE_ID": rand.choice([1, 1, 2]),
+                        "SITE_NAME": "SITE1", "SECONDARY_HOST": rand.choice(SECONDARY_HOSTS), "SECONDARY_PORT": 30001 + i,
+                        "SECONDARY_SITE_ID": secondary, "SECONDARY_SITE_NAME": rand.choice(SITE_NAMES[secondary]),
+                        "SECONDARY_ACTIVE_STATUS": rand.choice(["YES", "NO", "UNKNOWN"]), "REPLICATION_MODE": rand.choice(["SYNC", "ASYNC"]),
+                        "REPLICATION_STATUS": status, "REPLICATION_STATUS_DETAILS": "" if status == "ACTIVE" else "Connection refused"})
+            for column in fake.COLUMNS:
+                if column.endswith("_TIME"):
+                    row[column] = rand.choice([0, -1, 1600000000000000 + rand.randint(0, 10 ** 12)])
+                elif row[column] == 0 and column.endswith(("_COUNT", "_SIZE", "_POSITION", "_VERSION", "_DURATION")):
+                    row[column] = rand.randint(0, 1 << 40)
+            self.rows.append(row)
+
+    def getRows(self, requestSecondaryActiveStatus = True, host = ""):
+        return [copy.deepcopy(row) for row in self.rows if not host or row["HOST"].rsplit("-", 1)[0] == host]
+
+class NullStream(object):
+    def write(self, s):
+        pass
+
+    def flush(self):
+        pass
+
+class LandscapeTestCase(unittest.TestCase):
+    def setUp(self):
+        self.environ = dict(os.environ)
+        os.environ["SR_STATUS_CACHE_SOCKET"] = os.path.join(tempfile.gettempdir(), "systemReplicationStatusTest-%d.sock" % os.getpid()) # never a running daemon
+        self.backend = systemReplicationStatus.backend
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.environ)
+        systemReplicationStatus.setBackend(self.backend)
+
+class LandscapeConfigurationTest(LandscapeTestCase):
+    def testMatchesPreviousImplementation(self):
+        for seed in range(300):
+            landscape = RandomLandscape(seed)
+            systemReplicationStatus.setBackend(fake.FakeBackend(landscape))
+            for site in [None, "site2", "SITE3", "Site2", "nosuch"]:
+                self.assertEqual(systemReplicationStatus.getLandscapeConfiguration(site),
+                                 referenceLandscapeConfiguration(landscape.getRows(), site), "seed %d, site %r" % (seed, site))
+                for local in [False, True]:
+                    rows = landscape.getRows(True, "host000" if local else "")
+                    self.assertEqual(systemReplicationStatus.getLandscapeConfigurationUpdatedVersion(site, True, local),
+                                     referenceLandscapeConfigurationUpdatedVersion(rows, site), "seed %d, site %r, local %r" % (seed, site, local))
+
+    def testReturnsPlainDicts(self):
+        systemReplicationStatus.setBackend(fake.FakeBackend(RandomLandscape(1)))
+        for config, status in [systemReplicationStatus.getLandscapeConfiguration(None), systemReplicationStatus.getLandscapeConfigurationUpdatedVersion(None)]:
+            self.assertTrue(config)
+            self.assertTrue(all(type(row) is dict for row in config))
+
+    # non-ASCII values of the nameserver (unicode) and the command line (UTF-8) are compared case insensitive
+    def testNonAsciiFilters(self):
+        landscape = RandomLandscape(5)
+        for row in landscape.rows[::2]:
+            row["DATABASE"] = u"T\xc4ST"
+        systemReplicationStatus.setBackend(fake.FakeBackend(landscape))
+        sysRepStatus = systemReplicationStatus.SystemReplicationStatus()
+        expected = [row["PORT"] for row in landscape.rows[::2] if row["VOLUME_ID"]]
+        self.assertTrue(expected)
+        for database in ["t\xc3\xa4st", u"T\xe4st"]:
+            config, status = sysRepStatus.getLandscapeConfigurationUpdatedVersion(None, database = database)
+            self.assertEqual(sorted(row["PORT"] for row in config), expected)
+            self.assertEqual(sysRepStatus.getLandscapeConfigurationUpdatedVersion(None, host = "h\xc3\xa4st")[0], [])
+
+    def testNameserverDown(self):
+        systemReplicationStatus.setBackend(fake.FakeBackend(RandomLandscape(1), down = True))
+        self.assertEqual(systemReplicationStatus.getLandscapeConfiguration(None), ([], ServiceStatus.Error))
+        self.assertEqual(systemReplicationStatus.getLandscapeConfigurationUpdatedVersion(None), ([], ServiceStatus.Error))
+
+class TableRendererTest(LandscapeTestCase):
+    def output(self, function, *args):
+        stdout = sys.stdout
+        sys.stdout = output = StringIO.StringIO()
+        try:
+            function(*args)
+        finally:
+            sys.stdout = stdout
+        return output.getvalue()
+
+    # the short ([]), long (-a) and --sapcontrol output of the previous implementation, also for empty tables and missing columns
+    def testMatchesPreviousOutput(self):
+        for seed in range(100):
+            landscape = RandomLandscape(seed)
+            systemReplicationStatus.setBackend(fake.FakeBackend(landscape))
+            sysRepStatus = systemReplicationStatus.SystemReplicationStatus()
+            config, status = sysRepStatus.getLandscapeConfigurationUpdatedVersion(None)
+            if config and seed % 10 == 0:
+                config[-1] = dict((k, v) for k, v in config[-1].items() if k != "SECONDARY_SITE_NAME")
+            for longFormat in [False, True]:
+                format, names = sysRepStatus.getColumns(longFormat)
+                self.assertEqual(self.output(sysRepStatus.printDictList, config, format, names),
+                                 self.output(referencePrintDictList, config, format, names), "seed %d, long %r" % (seed, longFormat))
+            self.assertEqual(self.output(sysRepStatus.printSapcontrolRows, config), self.output(referencePrintSapcontrol, config), "seed %d" % seed)
+
+class StructuredOutputTest(LandscapeTestCase):
+    def write(self, outputFormat, landscape, columns = None):
+        systemReplicationStatus.setBackend(fake.FakeBackend(landscape))
+        output = StringIO.StringIO()
+        systemReplicationStatus.SystemReplicationStatus().getStatusAndWrite(outputFormat, None, stream = output, columns = columns)
+        return output.getvalue()
+
+    # the service fields come in the order of the table columns, csv writes non-ASCII values as UTF-8
+    def testServiceColumns(self):
+        landscape = RandomLandscape(1)
+        for row in landscape.rows:
+            row["SITE_NAME"] = u"S\xe4o Paulo"
+        systemReplicationStatus.setBackend(fake.FakeBackend(landscape))
+        longFormat = systemReplicationStatus.SystemReplicationStatus().getColumns(True)[0]
+        for columns in [None, ["SITE_NAME", "REPLICATION_STATUS", "HOST", "PORT", "SECONDARY_SITE_ID"]]:
+            expected = columns or longFormat
+            services = json.loads(self.write("json", landscape, columns), object_pairs_hook = collections.OrderedDict)["services"]
+            self.assertTrue(services)
+            for service in services:
+                self.assertEqual(service.keys()[:len(expected)], expected)
+                self.assertEqual(service["SITE_NAME"], u"S\xe4o Paulo")
+            line = json.loads(self.write("ndjson", landscape, columns).splitlines()[0], object_pairs_hook = collections.OrderedDict)
+            self.assertEqual(line.keys()[1:len(expected) + 1], expected) # after RECORD
+            table = list(csv.reader(StringIO.StringIO(self.write("csv", landscape, columns))))
+            self.assertEqual(table[0][:len(expected)], expected)
+            self.assertEqual(table[1][0 if columns else expected.index("SITE_NAME")].decode("utf-8"), u"S\xe4o Paulo")
+
+class ConfigurationStampTest(LandscapeTestCase):
+    def setUp(self):
+        LandscapeTestCase.setUp(self)
+        self.directory = tempfile.mkdtemp()
+        self.files = []
+        for variable, path in [("DIR_EXECUTABLE", "exe"), ("DIR_INSTANCE", "HDB00"), ("SAP_RETRIEVAL_PATH", os.path.join("HDB00", "host"))]:
+            os.environ[variable] = os.path.join(self.directory, path)
+        for path in [os.path.join("exe", "config"), os.path.join("SYS", "global", "hdb", "custom", "config"), os.path.join("HDB00", "host")]:
+            os.makedirs(os.path.join(self.directory, path))
+            self.files.append(os.path.join(self.directory, path, "global.ini"))
+            self.write(self.files[-1], "[system_replication]\n")
+        os.environ.pop("DIR_GLOBAL", None) # below DIR_INSTANCE
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.directory)
+        LandscapeTestCase.tearDown(self)
+
+    def write(self, path, text):
+        with open(path, "a") as f:
+            f.write(text)
+
+    # the read-only layer merges the default, system and host files, the customer layer the system and host files
+    def testEveryMergedFile(self):
+        backend = object.__new__(systemReplicationStatus.HanaBackend) # without NameServerPy
+        for i, path in enumerate(self.files):
+            stamps = dict((layer, backend.getConfigurationStamp("global.ini", layer)) for layer in ["READONLY", "CUSTOMER"])
+            self.write(path, "mode = primary\n")
+            self.assertNotEqual(backend.getConfigurationStamp("global.ini", "READONLY"), stamps["READONLY"], path)
+            self.assertEqual(backend.getConfigurationStamp("global.ini", "CUSTOMER") != stamps["CUSTOMER"], i > 0, path)
+
+class SessionTest(LandscapeTestCase):
+    def testLocalNameserverIsPreferred(self):
+        systemReplicationStatus.setBackend(fake.FakeBackend(RandomLandscape(1)))
+        session = systemReplicationStatus.SystemReplicationStatusSession()
+        for i in range(3):
+            session.reset()
+            self.assertTrue(session.isNsActive())
+            self.assertFalse(session.ns.master)
+        self.assertTrue(session.masterClient is None)
+
+    def testMasterNameserverAfterGrace(self):
+        systemReplicationStatus.setBackend(fake.FakeBackend(RandomLandscape(1), localHang = 3.0))
+        session = systemReplicationStatus.SystemReplicationStatusSession()
+        clients = set()
+        for i in range(3):
+            session.reset()
+            start = time.time()
+            self.assertTrue(session.isNsActive())
+            self.assertTrue(time.time() - start < 2.0)
+            self.assertTrue(session.ns.master)
+            clients.add(session.ns)
+        self.assertEqual(len(clients), 1)
+
+    # one instance kept across a nameserver outage, as the cluster manager does
+    def testReusedInstanceRecovers(self):
+        backend = fake.FakeBackend(RandomLandscape(1))
+        systemReplicationStatus.setBackend(backend)
+        sysRepStatus = systemReplicationStatus.SystemReplicationStatus()
+        stdout = sys.stdout
+        def calls(down):
+            backend.down = down
+            sys.stdout = NullStream()
+            try:
+                return [sysRepStatus.getLandscapeConfiguration(None)[1], sysRepStatus.getLandscapeConfigurationUpdatedVersion(None)[1],
+                        sysRepStatus.checkStatus(), sysRepStatus.getStatusAndPrint(False, None, False)]
+            finally:
+                sys.stdout = stdout
+        healthy = calls(False)
+        self.assertTrue(isinstance(healthy[0], dict) and isinstance(healthy[1], dict))
+        self.assertEqual(calls(True), [ServiceStatus.Error, ServiceStatus.Error, ServiceStatus.NoHSR, ServiceStatus.NoHSR])
+        probes = backend.calls["storeTrees"]
+        self.assertEqual(calls(False), healthy)
+        self.assertTrue(backend.calls["storeTrees"] >= probes + 4) # every call probes again
+
+    def testAbandonedCallKeepsItsSession(self):
+        systemReplicationStatus.setBackend(fake.FakeBackend(RandomLandscape(1), latency = 0.2))
+        sysRepStatus = systemReplicationStatus.SystemReplicationStatus()
+        session = sysRepStatus.session
+        request = sysRepStatus.getLandscapeConfigurationUpdatedVersionAsync(None, deadline = 0.05)
+        self.assertEqual(request.result(), ([], ServiceStatus.Unknown))
+        self.assertFalse(sysRepStatus.session is session)
+        request.finished.wait(5)
+        self.assertTrue(request.done())
+        self.assertEqual(sysRepStatus.session.nsCalls, 0)
+        self.assertTrue(session.nsCalls > 0)
+
+class CheckTest(LandscapeTestCase):
+    arguments = [[], ["--localhost"], ["--site=SITE2"], ["--site=site3"], ["--database=T00001"], ["--host=host001-1"], ["--service=indexserver"]]
+
+    def setUp(self):
+        LandscapeTestCase.setUp(self)
+        self.getuid = os.getuid
+        os.getuid = lambda: 1000 # main refuses to run as root
+        self.stdout = sys.stdout
+
+    def tearDown(self):
+        sys.stdout = self.stdout
+        os.getuid = self.getuid
+        LandscapeTestCase.tearDown(self)
+
+    def main(self, argv):
+        sys.stdout = NullStream()
+        try:
+            return systemReplicationStatus.main(argv)
+        finally:
+            sys.stdout = self.stdout
+
+    # --check answers the exit code of a full run, also on secondaries, without secondaries and without nameserver
+    def testMatchesFullRun(self):
+        rand = random.Random(0)
+        for seed in range(100):
+            landscape = fake.SyntheticLandscape(tenants = rand.randint(0, 3), services = rand.randint(1, 4), hosts = rand.randint(1, 3), targets = rand.randint(0, 2),
+                                                tiers = rand.randint(2, 3), unhealthy = rand.choice([0.0, 0.1, 0.5]), standby = rand.choice([0.0, 0.3]), seed = seed)
+            siteId = rand.choice(sorted(landscape.sites))
+            down = rand.random() < 0.1
+            for argv in CheckTest.arguments:
+                systemReplicationStatus.setBackend(fake.FakeBackend(landscape, siteId, down = down))
+                rc = self.main(argv)
+                systemReplicationStatus.setBackend(fake.FakeBackend(landscape, siteId, down = down))
+                self.assertEqual(self.main(["--check"] + argv), rc, "seed %d, site id %d, down %r, %r" % (seed, siteId, down, argv))
+
+    # the overall gauge of the exporter is the exit code of --check, the status is no label, so a series keeps its labels
+    def testExporterMatchesCheck(self):
+        rand = random.Random(2)
+        for seed in range(50):
+            landscape = fake.SyntheticLandscape(tenants = rand.randint(0, 2), services = rand.randint(1, 3), hosts = rand.randint(1, 2), targets = rand.randint(0, 2),
+                                                tiers = rand.randint(2, 3), unhealthy = rand.choice([0.0, 0.5]), seed = seed)
+            siteId = rand.choice(sorted(landscape.sites))
+            down = rand.random() < 0.2
+            systemReplicationStatus.setBackend(fake.FakeBackend(landscape, siteId, down = down))
+            rc = self.main(["--check"])
+            systemReplicationStatus.setBackend(fake.FakeBackend(landscape, siteId, down = down))
+            metrics = systemReplicationStatus.MetricsExporter().collect().splitlines()
+            message = "seed %d, site id %d, down %r" % (seed, siteId, down)
+            self.assertTrue("hana_sr_overall_replication_status %d" % rc in metrics, message)
+            self.assertFalse([line for line in metrics if "status=" in line], message)
+            if down or siteId != 1 or not landscape.mappings: # not running, not the primary or no secondaries
+                self.assertFalse([line for line in metrics if line.startswith(("hana_sr_service_", "hana_sr_site_"))], message)
+
+    def watch(self, sapcontrol):
+        sysRepStatus = systemReplicationStatus.SystemReplicationStatus()
+        sys.stdout = output = StringIO.StringIO()
+        try:
+            rc = sysRepStatus.watchStatus(0, False, None, sapcontrol, iterations = 1)
+        finally:
+            sys.stdout = self.stdout
+        return rc, output.getvalue(), sysRepStatus.checkLocalSite()
+
+    # a poll of --watch answers the exit code of a full run, on a secondary, without secondaries or without nameserver
+    # it also prints the same lines
+    def testWatchMatchesFullRun(self):
+        rand = random.Random(1)
+        for seed in range(50):
+            landscape = fake.SyntheticLandscape(tenants = rand.randint(0, 2), services = rand.randint(1, 3), hosts = rand.randint(1, 2), targets = rand.randint(0, 2),
+                                                tiers = rand.randint(2, 3), unhealthy = rand.choice([0.0, 0.5]), seed = seed)
+            siteId = rand.choice(sorted(landscape.sites))
+            down = rand.random() < 0.2
+            for sapcontrol in [False, True]:
+                systemReplicationStatus.setBackend(fake.FakeBackend(landscape, siteId, down = down))
+                sys.stdout = output = StringIO.StringIO()
+                try:
+                    rc = systemReplicationStatus.main(["--sapcontrol=1"] if sapcontrol else [])
+                finally:
+                    sys.stdout = self.stdout
+                systemReplicationStatus.setBackend(fake.FakeBackend(landscape, siteId, down = down))
+                watchRc, watchOutput, check = self.watch(sapcontrol)
+                message = "seed %d, site id %d, down %r, sapcontrol %r" % (seed, siteId, down, sapcontrol)
+                self.assertEqual(watchRc, rc, message)
+                if check is not None:
+                    if not sapcontrol:
+                        watchOutput = watchOutput.split("\n", 1)[1][:-1] # without the time stamp and the closing empty line
+                    self.assertEqual(watchOutput, output.getvalue(), message)
+
+class ReplicationMetricsTest(unittest.TestCase):
+    def row(self, port, last, shipped, lastTime, shippedTime, buffersSize, buffersDuration, siteId = 2):
+        row = dict.fromkeys(fake.COLUMNS, 0)
+        row.update({"HOST": "host000-1", "PORT": port, "SECONDARY_SITE_ID": siteId, "SECONDARY_SITE_NAME": "SITE%d" % siteId,
+                    "LAST_LOG_POSITION": last, "SHIPPED_LOG_POSITION": shipped, "LAST_LOG_POSITION_TIME": lastTime, "SHIPPED_LOG_POSITION_TIME": shippedTime,
+                    "SHIPPED_LOG_BUFFERS_SIZE": buffersSize, "SHIPPED_LOG_BUFFERS_DURATION": buffersDuration,
+                    "SHIPPED_FULL_REPLICA_SIZE": 1 << 30, "SHIPPED_FULL_REPLICA_DURATION": 60000000})
+        return row
+
+    # lags never get negative, unset times give no time lag, a site has the largest lag and the throughput of all of its services
+    def testLagAndThroughput(self):
+        rows = [self.row(30003, 5000, 3000, 10000000, 7500000, 4000000, 2000000), self.row(30040, 100, 200, 0, 0, 1000000, 3000000)]
+        services, sites = systemReplicationStatus.ReplicationMetrics().sample(rows, 100.0)
+        self.assertEqual([(m["LOG_POSITION_LAG"], m["LOG_TIME_LAG"], m["SHIPPING_THROUGHPUT"]) for m in services], [(2000, 2.5, 2000000), (0, None, 333333)])
+        self.assertEqual(services[0]["FULL_REPLICA_RATE"], 17895697)
+        self.assertEqual(services[0]["DELTA_REPLICA_RATE"], None) # nothing shipped yet
+        self.assertEqual(services[0]["SAMPLED_LOG_POSITION_RATE"], None) # first sample
+        site = sites[2]
+        self.assertEqual((site["SERVICES"], site["LOG_POSITION_LAG"], site["LOG_TIME_LAG"], site["SHIPPING_THROUGHPUT"]), (2, 2000, 2.5, 1000000))
+
+    # rates between two samples of the same instance, a counter that went back (reconnect) gives no rate
+    def testSampledRatesAndCounterReset(self):
+        metrics = systemReplicationStatus.ReplicationMetrics()
+        metrics.sample([self.row(30003, 5000, 3000, 0, 0, 400000, 1000), self.row(30040, 5000, 4000, 0, 0, 800000, 1000)], 100.0)
+        services, sites = metrics.sample([self.row(30003, 9000, 4000, 0, 0, 450000, 1000), self.row(30040, 9000, 50, 0, 0, 100, 1000)], 110.0)
+        self.assertEqual([(m["SAMPLED_LOG_POSITION_RATE"], m["SAMPLED_SHIPPING_THROUGHPUT"]) for m in services], [(100, 5000), (None, None)])
+        self.assertEqual((sites[2]["SAMPLED_LOG_POSITION_RATE"], sites[2]["SAMPLED_SHIPPING_THROUGHPUT"]), (100, 5000))
+        services, sites = metrics.sample([self.row(30003, 9000, 4000, 0, 0, 450000, 1000), self.row(30040, 9000, 150, 0, 0, 200, 1000)], 120.0)
+        self.assertEqual([m["SAMPLED_LOG_POSITION_RATE"] for m in services], [0, 10]) # counted again from the reset value
+
+class StatusCacheTest(LandscapeTestCase):
+    # the daemon of this test serves a landscape of the fake backend
+    daemonScript = "; ".join(["import sys", "sys.path.insert(0, sys.argv[1])", "import systemReplicationStatus, systemReplicationStatusFakeBackend as fake",
+                              "systemReplicationStatus.setBackend(fake.FakeBackend(fake.SyntheticLandscape(tenants = 2)))",
+                              "sys.exit(systemReplicationStatus.StatusCacheDaemon(sys.argv[2], float(sys.argv[3])).serve())"])
+
+    # a query within the ttl shares the fetch of the previous one, refresh() fetches again
+    def testTtlSharing(self):
+        fetches = []
+        def fetch():
+            fetches.append(len(fetches))
+            return len(fetches)
+        cache = systemReplicationStatus.LandscapeCache(60)
+        self.assertEqual([cache.get(("a",), fetch), cache.get(("a",), fetch)], [1, 1])
+        self.assertEqual(cache.get(("b",), fetch), 2)
+        cache.refresh()
+        self.assertEqual(len(fetches), 4)
+        self.assertEqual([cache.get(("a",), fetch), cache.get(("b",), fetch)], [3, 4])
+
+    # the module functions are answered by the daemon, whose nameserver is reachable, without a call to the local one
+    def testDaemonRoundTrip(self):
+        import subprocess
+        path = os.environ["SR_STATUS_CACHE_SOCKET"]
+        daemon = subprocess.Popen([sys.executable, "-c", StatusCacheTest.daemonScript, os.path.dirname(os.path.abspath(__file__)), path, "60"])
+        try:
+            client = systemReplicationStatus.StatusCacheClient(path)
+            for i in range(200):
+                if client.isAvailable():
+                    break
+                time.sleep(0.05)
+            backend = fake.FakeBackend(down = True)
+            systemReplicationStatus.setBackend(backend)
+            config, status = systemReplicationStatus.getLandscapeConfigurationUpdatedVersion(None)
+            self.assertEqual(len(config), len(fake.SyntheticLandscape(tenants = 2)))
+            self.assertEqual(sorted(status), [2])
+            self.assertEqual(systemReplicationStatus.getLandscapeConfigurationUpdatedVersion(None), (config, status)) # the same fetch within the ttl
+            self.assertEqual(systemReplicationStatus.getLandscapeConfiguration("site2")[1], {"SITE2": ServiceStatus.Active})
+            self.assertEqual(client.query("getServiceHost"), None) # not served
+            self.assertEqual(backend.calls, {})
+        finally:
+            daemon.terminate()
+            daemon.wait()
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(systemReplicationStatus.getLandscapeConfigurationUpdatedVersion(None), ([], ServiceStatus.Error))
+
+class MultiSystemCollectorTest(unittest.TestCase):
+    # a system that does not answer in time is UNKNOWN and does not hold up the others, output that is no status is an ERROR
+    def testTimeoutAndErrors(self):
+        document = '{"overall": {"REPLICATION_STATUS": "ACTIVE", "STATUS_CODE": 15}, "sites": [{"SITE_NAME": "SITE2", "REPLICATION_STATUS": "ACTIVE"}]}'
+        systems = [("hung", "sleep 10; echo {format}"), ("good", "echo 'banner'; echo '%s' # {format}" % document), ("broken", "echo 'no such command' >&2; exit 3 # {format}")]
+        start = time.time()
+        records, overall = systemReplicationStatus.MultiSystemCollector(systems, timeout = 1.0).collect()
+        self.assertTrue(time.time() - start < 5)
+        self.assertEqual([(r["SYSTEM"], r["STATUS_CODE"]) for r in records], [("hung", ServiceStatus.Unknown), ("good", ServiceStatus.Active), ("broken", ServiceStatus.Error)])
+        self.assertEqual(records[0]["ERROR"], "no answer within 1.0 seconds")
+        self.assertEqual(records[1]["SITES"], "SITE2:ACTIVE")
+        self.assertEqual(records[2]["ERROR"], "exit code 3: no such command")
+        self.assertEqual(overall, ServiceStatus.Error)
+        records, overall = systemReplicationStatus.MultiSystemCollector(systems[:2], timeout = 1.0).collect()
+        self.assertEqual(overall, ServiceStatus.Unknown)
+
+class LandscapeTreeTest(LandscapeTestCase):
+    def tree(self, landscape):
+        systemReplicationStatus.setBackend(fake.FakeBackend(landscape))
+        root, skipped = systemReplicationStatus.buildLandscapeTree()
+        return [(node.id, depth) for node, depth in systemReplicationStatus.walkTree(root)], skipped
+
+    # a mapping back to an ancestor, or to the site itself, is a cycle and not followed
+    def testCycle(self):
+        landscape = fake.SyntheticLandscape(tenants = 0, targets = 1, tiers = 3)
+        landscape.mappings[3] = [1, 3]
+        self.assertEqual(self.tree(landscape), ([("1", 0), ("2", 1), ("3", 2)], [("3", "1", "cycle"), ("3", "3", "cycle")]))
+
+    # a second mapping to a site that is no ancestor (a diamond) is a duplicate and not followed either
+    def testDuplicate(self):
+        landscape = fake.SyntheticLandscape(tenants = 0, targets = 2, tiers = 3) # 1 -> 2 -> 3 and 1 -> 4 -> 5
+        landscape.mappings[4].append(3)
+        landscape.mappings[5] = [2]
+        self.assertEqual(self.tree(landscape), ([("1", 0), ("2", 1), ("3", 2), ("4", 1), ("5", 2)], [("4", "3", "duplicate"), ("5", "2", "duplicate")]))
+
+class StatusHistoryTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "history")
+
+    def tearDown(self):
+        for name in os.listdir(self.directory):
+            os.remove(os.path.join(self.directory, name))
+        os.rmdir(self.directory)
+
+    def rows(self, status):
+        landscape = RandomLandscape(3)
+        rows = [row for row in landscape.getRows() if row["VOLUME_ID"]]
+        for row in rows:
+            row["REPLICATION_STATUS"] = status
+        return rows
+
+    def testRecordSize(self):
+        import struct
+        self.assertEqual(systemReplicationStatus.StatusHistory.recordSize, struct.calcsize(systemReplicationStatus.StatusHistory.recordFormat))
+
+    def testSmallFileKeepsSamples(self):
+        history = systemReplicationStatus.StatusHistory(self.path, 64 << 10, 2)
+        history.open()
+        rows = self.rows("ACTIVE")
+        for i in range(10):
+            history.append(rows, 1600000000 + i)
+        history.close()
+        self.assertEqual(history.paths(), [self.path])
+        services, sites = history.trends(1600000000, 1600000010)
+        self.assertTrue(services)
+        self.assertTrue(all(service["SAMPLES"] == 10 for service in services))
+
+    def testStoppedIsNotCountedAsNotActive(self):
+        history = systemReplicationStatus.StatusHistory(self.path)
+        history.open()
+        for i, status in enumerate(["ACTIVE", "STOPPED", "TENANTCOPY", "SYNCING", "ERROR"]):
+            history.append(self.rows(status), 1600000000 + i)
+        history.close()
+        services, sites = history.trends(1600000000, 1600000010)
+        self.assertTrue(services)
+        self.assertTrue(all(service["SAMPLES"] == 5 and service["NOT_ACTIVE_SAMPLES"] == 2 for service in services))
+
+if __name__ == "__main__":
+    unittest.main()